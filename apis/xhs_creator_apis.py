@@ -1,12 +1,15 @@
-import requests
 from xhs_utils.cookie_util import trans_cookies
+from xhs_utils.session_util import Session_Pool
+from xhs_utils.timeout_util import API_TIMEOUT, get_timeout
 from xhs_utils.xhs_creator_util import get_common_headers, generate_xs
 from xhs_utils.xhs_util import generate_x_b3_traceid
 
 
 class XHS_Creator_Apis():
-    def __init__(self):
+    def __init__(self, pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 0.5, timeout: tuple = API_TIMEOUT):
         self.base_url = "https://creator.xiaohongshu.com"
+        self.sessions = Session_Pool(pool_size, max_retries, backoff_factor)
+        self.timeout = timeout
 
 
     # page: 页数
@@ -27,7 +30,7 @@ class XHS_Creator_Apis():
             }
             if page:
                 params["page"] = str(page)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, params=params)
+            response = self.sessions.get(self.base_url).get(self.base_url + api, headers=headers, cookies=cookies, params=params, timeout=get_timeout(self.timeout))
             res_json = response.json()
             success = res_json["success"]
         except Exception as e:
@@ -1,9 +1,20 @@
 # encoding: utf-8
 import json
+import os
 import re
 import urllib
 import requests
-from xhs_utils.xhs_util import splice_str, generate_request_params, generate_x_b3_traceid, get_common_headers
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+from xhs_utils.cache_util import Response_Cache
+from xhs_utils.limit_util import Rate_Limiter, is_throttled, get_family
+from xhs_utils.metrics_util import get_endpoint, metrics
+from xhs_utils.page_util import Page_Iterator, parse_cursor_page, parse_number_page
+from xhs_utils.replay_util import Recorder
+from xhs_utils.session_util import Session_Pool
+from xhs_utils.timeout_util import API_TIMEOUT, Latency_Tracker, bind, get_timeout
+from xhs_utils.trace_util import tracer
+from xhs_utils.xhs_util import splice_str, parse_url, generate_request_params, generate_x_b3_traceid, get_common_headers
 from loguru import logger
 
 """
@@ -11,21 +22,158 @@ from loguru import logger
     :param cookies_str: 你的cookies
 """
 class XHS_Apis():
-    def __init__(self):
-        self.base_url = "https://edith.xiaohongshu.com"
+    def __init__(self, pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 0.5, rate_limit: bool = True, limiter: Rate_Limiter = None, throttle_retries: int = 2,
+                 cache: Response_Cache = None, timeout: tuple = API_TIMEOUT, hedge_percentile: float = None, base_url: str = None, recorder: Recorder = None):
+        """
+            :param pool_size: 每个 host 保持的最大连接数, 并发使用同一个实例时按线程数设置
+            :param max_retries: 连接失败和 5xx 时的重试次数
+            :param backoff_factor: 重试间隔的退避系数
+            :param rate_limit: 是否按接口类别限速, 被限流时自动降速
+            :param limiter: 多个实例共用的限速器, 不传时每个实例单独创建
+            :param throttle_retries: 被限流时降速后重试的次数
+            :param cache: 响应缓存, 用于 get_user_info / get_note_info / get_search_keyword / get_homefeed_all_channel, 不传时不缓存
+            :param timeout: (连接超时, 读取超时) 秒数, 同时不会超过 deadline 设置的截止时间
+            :param hedge_percentile: 对冲请求, 如 95 表示 GET 请求超过同类接口 p95 响应时间还没返回时再发一个相同的请求, 用先返回的结果
+            :param base_url: 接口地址, 默认为环境变量 XHS_BASE_URL 或 https://edith.xiaohongshu.com, 离线测试时指向 Replay_Server
+            :param recorder: 录制请求和响应, 用于 Replay_Server 回放
+        """
+        self.base_url = base_url or os.environ.get('XHS_BASE_URL') or "https://edith.xiaohongshu.com"
+        self.recorder = recorder
+        self.sessions = Session_Pool(pool_size, max_retries, backoff_factor, [recorder.hook] if recorder is not None else None)
+        self.limiter = (limiter if limiter is not None else Rate_Limiter()) if rate_limit else None
+        self.throttle_retries = throttle_retries
+        self.cache = cache
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.latency = Latency_Tracker()
+        self.hedge_executor = ThreadPoolExecutor(max_workers=pool_size * 2, thread_name_prefix='xhs_hedge') if hedge_percentile else None
+
+    def _send(self, method: str, api: str, cookies_str: str, data=None, proxies: dict = None):
+        """
+            签名并发送一次请求, 返回 response
+        """
+        if self.limiter is not None:
+            # 先等令牌再签名, 避免签名里的时间戳在等待中过期
+            with tracer.span('rate_limit'):
+                self.limiter.acquire(api)
+        timeout = get_timeout(self.timeout)
+        headers, cookies, trans_data = generate_request_params(cookies_str, api, data if data else '')
+        session = self.sessions.get(self.base_url)
+        endpoint = get_endpoint(api)
+        start = time.monotonic()
+        try:
+            with metrics.timer('xhs_api_request_seconds', gauge='xhs_api_in_flight', endpoint=endpoint), tracer.span('http', endpoint=endpoint):
+                if method == 'GET':
+                    response = session.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies, timeout=timeout)
+                else:
+                    response = session.post(self.base_url + api, headers=headers, data=trans_data.encode('utf-8'), cookies=cookies, proxies=proxies, timeout=timeout)
+        except Exception as e:
+            metrics.inc('xhs_api_requests_total', endpoint=endpoint, status=type(e).__name__)
+            raise
+        metrics.inc('xhs_api_requests_total', endpoint=endpoint, status=response.status_code)
+        self.latency.add(get_family(api), time.monotonic() - start)
+        return response
+
+    def _send_hedged(self, method: str, api: str, cookies_str: str, data=None, proxies: dict = None):
+        """
+            GET 请求超过 hedge_percentile 分位的响应时间还没返回时, 再发一个相同的请求, 返回先成功的那个
+        """
+        threshold = self.latency.percentile(get_family(api), self.hedge_percentile) if self.hedge_executor is not None and method == 'GET' else None
+        if threshold is None:
+            return self._send(method, api, cookies_str, data, proxies)
+        send = bind(self._send)
+        futures = [self.hedge_executor.submit(send, method, api, cookies_str, data, proxies)]
+        done, _ = wait(futures, timeout=threshold)
+        if not done:
+            futures.append(self.hedge_executor.submit(send, method, api, cookies_str, data, proxies))
+        error = None
+        for future in as_completed(futures):
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        raise error
+
+    def _request(self, method: str, api: str, cookies_str: str, data=None, proxies: dict = None):
+        """
+            签名并发送请求, 连接由 self.sessions 复用
+            :param method: GET 或 POST
+            :param api: 接口路径, GET 请求需要带上拼接好的参数
+            :param data: POST 的请求体
+            返回 success, msg, res_json
+        """
+        res_json = None
+        try:
+            for attempt in range(self.throttle_retries + 1):
+                response = self._send_hedged(method, api, cookies_str, data, proxies)
+                try:
+                    res_json = response.json()
+                except ValueError:
+                    res_json = None
+                if self.limiter is None or not self.limiter.feedback(api, is_throttled(response.status_code, res_json)):
+                    break
+            if res_json is None:
+                raise Exception(f'http {response.status_code}: {response.text[:100]}')
+            success, msg = res_json["success"], res_json["msg"]
+        except Exception as e:
+            success = False
+            msg = str(e)
+        if not success:
+            metrics.inc('xhs_api_errors_total', endpoint=get_endpoint(api), code=res_json.get('code', 'unknown') if isinstance(res_json, dict) else 'exception')
+        return success, msg, res_json
 
-    def get_homefeed_all_channel(self, cookies_str: str, proxies: dict = None):
+    def _cached(self, endpoint: str, params, use_cache: bool, request):
+        """
+            先查缓存, 没有时调用 request() 发请求, 成功的响应写入缓存
+            :param params: 决定响应内容的参数, 作为缓存的 key
+            :param use_cache: 为 False 时跳过缓存直接请求, 结果仍然写入缓存
+        """
+        if self.cache is None:
+            return request()
+        if use_cache:
+            res_json = self.cache.get(endpoint, params)
+            if res_json is not None:
+                return True, res_json.get("msg", "success"), res_json
+        success, msg, res_json = request()
+        if success:
+            self.cache.set(endpoint, params, res_json)
+        return success, msg, res_json
+
+    def _pages(self, fetch, parse, state, limit: int = None, prefetch: bool = True):
+        """
+            创建翻页迭代器, AsyncXHS_Apis 里替换为 async 版本
+            :param prefetch: 返回当前页时在后台请求下一页; 只取前几条就停止的调用方传 False (各 iter_* 的 prefetch 参数), 不会多请求一页
+        """
+        return Page_Iterator(fetch, parse, state, limit, prefetch)
+
+    def _collect(self, pages):
+        """
+            把翻页迭代器的数据全部取出, 返回 success, msg, 数据列表
+        """
+        item_list = list(pages)
+        return pages.success, pages.msg, item_list
+
+    @staticmethod
+    def _parse_user_url(user_url: str, default_source: str):
+        """
+            从用户主页链接中取出 user_id, xsec_token, xsec_source
+        """
+        with tracer.span('parse_url'):
+            user_id, kvDist = parse_url(user_url)
+        xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
+        xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else default_source
+        return user_id, xsec_token, xsec_source
+
+    def get_homefeed_all_channel(self, cookies_str: str, proxies: dict = None, use_cache: bool = True):
         """
             获取主页的所有频道
+            :param use_cache: 设置了 cache 时是否使用缓存
             返回主页的所有频道
         """
         res_json = None
         try:
             api = "/api/sns/web/v1/homefeed/category"
-            headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._cached('get_homefeed_all_channel', None, use_cache, lambda: self._request('GET', api, cookies_str, proxies=proxies))
         except Exception as e:
             success = False
             msg = str(e)
@@ -62,15 +210,26 @@ class XHS_Apis():
                 ],
                 "need_filter_image": False
             }
-            headers, cookies, trans_data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=trans_data, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('POST', api, cookies_str, data, proxies)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
+    def iter_homefeed_recommend(self, category, cookies_str: str, require_num: int = None, proxies: dict = None, prefetch: bool = True):
+        """
+            逐条获取主页推荐的笔记, 边翻页边返回
+            :param category: 你想要获取的频道
+            :param require_num: 最多获取的数量, 不指定时一直翻页, 调用方自己停止
+            :param cookies_str: 你的cookies
+        """
+        def parse(res_json, state):
+            if "items" not in res_json["data"]:
+                return [], None
+            cursor_score, refresh_type, note_index = state
+            return res_json["data"]["items"], (res_json["data"]["cursor_score"], 3, note_index + 20)
+        return self._pages(lambda state: self.get_homefeed_recommend(category, *state, cookies_str, proxies), parse, ("", 1, 0), require_num, prefetch=prefetch)
+
     def get_homefeed_recommend_by_num(self, category, require_num, cookies_str: str, proxies: dict = None):
         """
             根据数量获取主页推荐的笔记
@@ -79,34 +238,14 @@ class XHS_Apis():
             :param cookies_str: 你的cookies
             根据数量返回主页推荐的笔记
         """
-        cursor_score, refresh_type, note_index = "", 1, 0
-        note_list = []
-        try:
-            while True:
-                success, msg, res_json = self.get_homefeed_recommend(category, cursor_score, refresh_type, note_index, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                if "items" not in res_json["data"]:
-                    break
-                notes = res_json["data"]["items"]
-                note_list.extend(notes)
-                cursor_score = res_json["data"]["cursor_score"]
-                refresh_type = 3
-                note_index += 20
-                if len(note_list) > require_num:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        if len(note_list) > require_num:
-            note_list = note_list[:require_num]
-        return success, msg, note_list
+        return self._collect(self.iter_homefeed_recommend(category, cookies_str, require_num, proxies))
 
-    def get_user_info(self, user_id: str, cookies_str: str, proxies: dict = None):
+    def get_user_info(self, user_id: str, cookies_str: str, proxies: dict = None, use_cache: bool = True):
         """
             获取用户的信息
             :param user_id: 你想要获取的用户的id
             :param cookies_str: 你的cookies
+            :param use_cache: 设置了 cache 时是否使用缓存
             返回用户的信息
         """
         res_json = None
@@ -116,10 +255,7 @@ class XHS_Apis():
                 "target_user_id": user_id
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._cached('get_user_info', user_id, use_cache, lambda: self._request('GET', splice_api, cookies_str, proxies=proxies))
         except Exception as e:
             success = False
             msg = str(e)
@@ -134,10 +270,7 @@ class XHS_Apis():
         res_json = None
         try:
             api = f"/api/sns/web/v1/user/selfinfo"
-            headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('GET', api, cookies_str, proxies=proxies)
         except Exception as e:
             success = False
             msg = str(e)
@@ -153,10 +286,7 @@ class XHS_Apis():
         res_json = None
         try:
             api = f"/api/sns/web/v2/user/me"
-            headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('GET', api, cookies_str, proxies=proxies)
         except Exception as e:
             success = False
             msg = str(e)
@@ -182,48 +312,48 @@ class XHS_Apis():
                 "xsec_source": xsec_source,
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('GET', splice_api, cookies_str, proxies=proxies)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
 
-    def get_user_all_notes(self, user_url: str, cookies_str: str, proxies: dict = None):
+    @staticmethod
+    def cut_at_known_notes(notes: list, known_note_ids):
+        """
+            增量同步时截断一页笔记, 遇到已知的笔记后面的都不要
+            置顶的笔记总是排在最前面, 不能作为截断的依据
+            返回 新的笔记, 是否遇到了已知的笔记
+        """
+        new_notes = []
+        for note in notes:
+            sticky = note.get('interact_info', {}).get('sticky', False)
+            if not sticky and note['note_id'] in known_note_ids:
+                return new_notes, True
+            if not (sticky and note['note_id'] in known_note_ids):
+                new_notes.append(note)
+        return new_notes, False
+
+    def iter_user_all_notes(self, user_url: str, cookies_str: str, proxies: dict = None, known_note_ids=None, prefetch: bool = True):
+        """
+            逐条获取用户的笔记, 边翻页边返回
+            :param known_note_ids: 增量同步, 上次同步时最新的几个笔记id, 翻页遇到其中之一就停止
+        """
+        user_id, xsec_token, xsec_source = self._parse_user_url(user_url, "pc_search")
+        cut = (lambda notes: self.cut_at_known_notes(notes, known_note_ids)) if known_note_ids else None
+        return self._pages(lambda cursor: self.get_user_note_info(user_id, cursor, cookies_str, xsec_token, xsec_source, proxies),
+                           parse_cursor_page("notes", cut), '', prefetch=prefetch)
+
+    def get_user_all_notes(self, user_url: str, cookies_str: str, proxies: dict = None, known_note_ids=None):
         """
            获取用户所有笔记
            :param user_id: 你想要获取的用户的id
            :param cookies_str: 你的cookies
-           返回用户的所有笔记
+           :param known_note_ids: 增量同步, 上次同步时最新的几个笔记id, 翻页遇到其中之一就停止
+           返回用户的所有笔记, 增量同步时只返回新的笔记
         """
-        cursor = ''
-        note_list = []
-        try:
-            urlParse = urllib.parse.urlparse(user_url)
-            user_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
-            xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search"
-            while True:
-                success, msg, res_json = self.get_user_note_info(user_id, cursor, cookies_str, xsec_token, xsec_source, proxies)
-                if not success:
-                    raise Exception(msg)
-                notes = res_json["data"]["notes"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                note_list.extend(notes)
-                if len(notes) == 0 or not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, note_list
+        return self._collect(self.iter_user_all_notes(user_url, cookies_str, proxies, known_note_ids))
 
     def get_user_like_note_info(self, user_id: str, cursor: str, cookies_str: str, xsec_token='', xsec_source='', proxies: dict = None):
         """
@@ -245,15 +375,20 @@ class XHS_Apis():
                 "xsec_source": xsec_source,
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('GET', splice_api, cookies_str, proxies=proxies)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
+    def iter_user_all_like_note_info(self, user_url: str, cookies_str: str, proxies: dict = None, prefetch: bool = True):
+        """
+            逐条获取用户喜欢的笔记, 边翻页边返回
+        """
+        user_id, xsec_token, xsec_source = self._parse_user_url(user_url, "pc_user")
+        return self._pages(lambda cursor: self.get_user_like_note_info(user_id, cursor, cookies_str, xsec_token, xsec_source, proxies),
+                           parse_cursor_page("notes"), '', prefetch=prefetch)
+
     def get_user_all_like_note_info(self, user_url: str, cookies_str: str, proxies: dict = None):
         """
             获取用户所有喜欢笔记
@@ -261,32 +396,7 @@ class XHS_Apis():
             :param cookies_str: 你的cookies
             返回用户的所有喜欢笔记
         """
-        cursor = ''
-        note_list = []
-        try:
-            urlParse = urllib.parse.urlparse(user_url)
-            user_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
-            xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_user"
-            while True:
-                success, msg, res_json = self.get_user_like_note_info(user_id, cursor, cookies_str, xsec_token,
-                                                                      xsec_source, proxies)
-                if not success:
-                    raise Exception(msg)
-                notes = res_json["data"]["notes"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                note_list.extend(notes)
-                if len(notes) == 0 or not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, note_list
+        return self._collect(self.iter_user_all_like_note_info(user_url, cookies_str, proxies))
 
     def get_user_collect_note_info(self, user_id: str, cursor: str, cookies_str: str, xsec_token='', xsec_source='', proxies: dict = None):
         """
@@ -308,15 +418,20 @@ class XHS_Apis():
                 "xsec_source": xsec_source,
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('GET', splice_api, cookies_str, proxies=proxies)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
+    def iter_user_all_collect_note_info(self, user_url: str, cookies_str: str, proxies: dict = None, prefetch: bool = True):
+        """
+            逐条获取用户收藏的笔记, 边翻页边返回
+        """
+        user_id, xsec_token, xsec_source = self._parse_user_url(user_url, "pc_search")
+        return self._pages(lambda cursor: self.get_user_collect_note_info(user_id, cursor, cookies_str, xsec_token, xsec_source, proxies),
+                           parse_cursor_page("notes"), '', prefetch=prefetch)
+
     def get_user_all_collect_note_info(self, user_url: str, cookies_str: str, proxies: dict = None):
         """
             获取用户所有收藏笔记
@@ -324,47 +439,21 @@ class XHS_Apis():
             :param cookies_str: 你的cookies
             返回用户的所有收藏笔记
         """
-        cursor = ''
-        note_list = []
-        try:
-            urlParse = urllib.parse.urlparse(user_url)
-            user_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
-            xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search"
-            while True:
-                success, msg, res_json = self.get_user_collect_note_info(user_id, cursor, cookies_str, xsec_token,
-                                                                         xsec_source, proxies)
-                if not success:
-                    raise Exception(msg)
-                notes = res_json["data"]["notes"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                note_list.extend(notes)
-                if len(notes) == 0 or not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, note_list
+        return self._collect(self.iter_user_all_collect_note_info(user_url, cookies_str, proxies))
 
-    def get_note_info(self, url: str, cookies_str: str, proxies: dict = None):
+    def get_note_info(self, url: str, cookies_str: str, proxies: dict = None, use_cache: bool = True):
         """
             获取笔记的详细
             :param url: 你想要获取的笔记的url
             :param cookies_str: 你的cookies
             :param xsec_source: 你的xsec_source 默认为pc_search pc_user pc_feed
+            :param use_cache: 设置了 cache 时是否使用缓存, 缓存按 note_id, 不区分 xsec_token
             返回笔记的详细
         """
         res_json = None
         try:
-            urlParse = urllib.parse.urlparse(url)
-            note_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
+            with tracer.span('parse_url'):
+                note_id, kvDist = parse_url(url)
             api = f"/api/sns/web/v1/feed"
             data = {
                 "source_note_id": note_id,
@@ -379,21 +468,19 @@ class XHS_Apis():
                 "xsec_source": kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search",
                 "xsec_token": kvDist['xsec_token']
             }
-            headers, cookies, data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=data, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._cached('get_note_info', note_id, use_cache, lambda: self._request('POST', api, cookies_str, data, proxies))
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
 
-    def get_search_keyword(self, word: str, cookies_str: str, proxies: dict = None):
+    def get_search_keyword(self, word: str, cookies_str: str, proxies: dict = None, use_cache: bool = True):
         """
             获取搜索关键词
             :param word: 你的关键词
             :param cookies_str: 你的cookies
+            :param use_cache: 设置了 cache 时是否使用缓存
             返回搜索关键词
         """
         res_json = None
@@ -403,10 +490,7 @@ class XHS_Apis():
                 "keyword": urllib.parse.quote(word)
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._cached('get_search_keyword', word.strip(), use_cache, lambda: self._request('GET', splice_api, cookies_str, proxies=proxies))
         except Exception as e:
             success = False
             msg = str(e)
@@ -510,15 +594,19 @@ class XHS_Apis():
                     "avif"
                 ]
             }
-            headers, cookies, data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=data.encode('utf-8'), cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('POST', api, cookies_str, data, proxies)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
+    def iter_search_note(self, query: str, cookies_str: str, require_num: int = None, sort_type_choice=0, note_type=0, note_time=0, note_range=0, pos_distance=0, geo="", proxies: dict = None, prefetch: bool = True):
+        """
+            逐条获取搜索的笔记, 边翻页边返回, 参数和 search_some_note 一致
+        """
+        return self._pages(lambda page: self.search_note(query, cookies_str, page, sort_type_choice, note_type, note_time, note_range, pos_distance, geo, proxies),
+                           parse_number_page("items"), 1, require_num, prefetch=prefetch)
+
     def search_some_note(self, query: str, require_num: int, cookies_str: str, sort_type_choice=0, note_type=0, note_time=0, note_range=0, pos_distance=0, geo="", proxies: dict = None):
         """
             指定数量搜索笔记，设置排序方式和笔记类型和笔记数量
@@ -533,26 +621,7 @@ class XHS_Apis():
             :param geo: 定位信息 经纬度
             返回搜索的结果
         """
-        page = 1
-        note_list = []
-        try:
-            while True:
-                success, msg, res_json = self.search_note(query, cookies_str, page, sort_type_choice, note_type, note_time, note_range, pos_distance, geo, proxies)
-                if not success:
-                    raise Exception(msg)
-                if "items" not in res_json["data"]:
-                    break
-                notes = res_json["data"]["items"]
-                note_list.extend(notes)
-                page += 1
-                if len(note_list) >= require_num or not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        if len(note_list) > require_num:
-            note_list = note_list[:require_num]
-        return success, msg, note_list
+        return self._collect(self.iter_search_note(query, cookies_str, require_num, sort_type_choice, note_type, note_time, note_range, pos_distance, geo, proxies))
 
     def search_user(self, query: str, cookies_str: str, page=1, proxies: dict = None):
         """
@@ -575,15 +644,18 @@ class XHS_Apis():
                     "request_id": "22471139-1723999898524"
                 }
             }
-            headers, cookies, data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=data.encode('utf-8'), cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('POST', api, cookies_str, data, proxies)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
+    def iter_search_user(self, query: str, cookies_str: str, require_num: int = None, proxies: dict = None, prefetch: bool = True):
+        """
+            逐条获取搜索的用户, 边翻页边返回
+        """
+        return self._pages(lambda page: self.search_user(query, cookies_str, page, proxies), parse_number_page("users"), 1, require_num, prefetch=prefetch)
+
     def search_some_user(self, query: str, require_num: int, cookies_str: str, proxies: dict = None):
         """
             指定数量搜索用户
@@ -592,26 +664,7 @@ class XHS_Apis():
             :param cookies_str 你的cookies
             返回搜索的结果
         """
-        page = 1
-        user_list = []
-        try:
-            while True:
-                success, msg, res_json = self.search_user(query, cookies_str, page, proxies)
-                if not success:
-                    raise Exception(msg)
-                if "users" not in res_json["data"]:
-                    break
-                users = res_json["data"]["users"]
-                user_list.extend(users)
-                page += 1
-                if len(user_list) >= require_num or not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        if len(user_list) > require_num:
-            user_list = user_list[:require_num]
-        return success, msg, user_list
+        return self._collect(self.iter_search_user(query, cookies_str, require_num, proxies))
 
     def get_note_out_comment(self, note_id: str, cursor: str, xsec_token: str, cookies_str: str, proxies: dict = None):
         """
@@ -632,15 +685,18 @@ class XHS_Apis():
                 "xsec_token": xsec_token
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('GET', splice_api, cookies_str, proxies=proxies)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
+    def iter_note_all_out_comment(self, note_id: str, xsec_token: str, cookies_str: str, proxies: dict = None, prefetch: bool = True):
+        """
+            逐条获取笔记的一级评论, 边翻页边返回
+        """
+        return self._pages(lambda cursor: self.get_note_out_comment(note_id, cursor, xsec_token, cookies_str, proxies), parse_cursor_page("comments"), '', prefetch=prefetch)
+
     def get_note_all_out_comment(self, note_id: str, xsec_token: str, cookies_str: str, proxies: dict = None):
         """
             获取笔记的全部一级评论
@@ -648,25 +704,7 @@ class XHS_Apis():
             :param cookies_str 你的cookies
             返回笔记的全部一级评论
         """
-        cursor = ''
-        note_out_comment_list = []
-        try:
-            while True:
-                success, msg, res_json = self.get_note_out_comment(note_id, cursor, xsec_token, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                comments = res_json["data"]["comments"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                note_out_comment_list.extend(comments)
-                if len(note_out_comment_list) == 0 or not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, note_out_comment_list
+        return self._collect(self.iter_note_all_out_comment(note_id, xsec_token, cookies_str, proxies))
 
     def get_note_inner_comment(self, comment: dict, cursor: str, xsec_token: str, cookies_str: str, proxies: dict = None):
         """
@@ -689,15 +727,19 @@ class XHS_Apis():
                 "xsec_token": xsec_token
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('GET', splice_api, cookies_str, proxies=proxies)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
+    def iter_note_all_inner_comment(self, comment: dict, xsec_token: str, cookies_str: str, proxies: dict = None, prefetch: bool = True):
+        """
+            逐条获取一级评论下还没有返回的二级评论, 边翻页边返回
+        """
+        return self._pages(lambda cursor: self.get_note_inner_comment(comment, cursor, xsec_token, cookies_str, proxies),
+                           parse_cursor_page("comments"), comment['sub_comment_cursor'], prefetch=prefetch)
+
     def get_note_all_inner_comment(self, comment: dict, xsec_token: str, cookies_str: str, proxies: dict = None):
         """
             获取笔记的全部二级评论
@@ -708,46 +750,46 @@ class XHS_Apis():
         try:
             if not comment['sub_comment_has_more']:
                 return True, 'success', comment
-            cursor = comment['sub_comment_cursor']
-            inner_comment_list = []
-            while True:
-                success, msg, res_json = self.get_note_inner_comment(comment, cursor, xsec_token, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                comments = res_json["data"]["comments"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                inner_comment_list.extend(comments)
-                if not res_json["data"]["has_more"]:
-                    break
+            success, msg, inner_comment_list = self._collect(self.iter_note_all_inner_comment(comment, xsec_token, cookies_str, proxies))
+            if not success:
+                raise Exception(msg)
             comment['sub_comments'].extend(inner_comment_list)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, comment
 
-    def get_note_all_comment(self, url: str, cookies_str: str, proxies: dict = None):
+    def get_note_all_comment(self, url: str, cookies_str: str, proxies: dict = None, max_workers: int = 8):
         """
             获取一篇文章的所有评论
+            一级评论边翻页边把二级评论交给线程池展开, 返回的结构和顺序与逐条展开时一致
             :param note_id: 你想要获取的笔记的id
             :param cookies_str: 你的cookies
+            :param max_workers: 同时展开二级评论的线程数, 1 为逐条展开
             返回一篇文章的所有评论
         """
         out_comment_list = []
-        try:
-            urlParse = urllib.parse.urlparse(url)
-            note_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            success, msg, out_comment_list = self.get_note_all_out_comment(note_id, kvDist['xsec_token'], cookies_str, proxies)
-            if not success:
-                raise Exception(msg)
-            for comment in out_comment_list:
-                success, msg, new_comment = self.get_note_all_inner_comment(comment, kvDist['xsec_token'], cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
+        futures = []
+        try:
+            note_id, kvDist = parse_url(url)
+            pages = self.iter_note_all_out_comment(note_id, kvDist['xsec_token'], cookies_str, proxies)
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='inner_comment') as executor:
+                try:
+                    for comment in pages:
+                        out_comment_list.append(comment)
+                        # 二级评论直接写回 comment['sub_comments'], 顺序由 out_comment_list 保证
+                        if comment['sub_comment_has_more']:
+                            futures.append(executor.submit(bind(self.get_note_all_inner_comment), comment, kvDist['xsec_token'], cookies_str, proxies))
+                    if not pages.success:
+                        raise Exception(pages.msg)
+                    for future in futures:
+                        success, msg, new_comment = future.result()
+                        if not success:
+                            raise Exception(msg)
+                finally:
+                    for future in futures:
+                        future.cancel()
+            success, msg = True, 'success'
         except Exception as e:
             success = False
             msg = str(e)
@@ -762,10 +804,7 @@ class XHS_Apis():
         res_json = None
         try:
             api = "/api/sns/web/unread_count"
-            headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('GET', api, cookies_str, proxies=proxies)
         except Exception as e:
             success = False
             msg = str(e)
@@ -786,40 +825,25 @@ class XHS_Apis():
                 "cursor": cursor
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('GET', splice_api, cookies_str, proxies=proxies)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
+    def iter_all_metions(self, cookies_str: str, proxies: dict = None, prefetch: bool = True):
+        """
+            逐条获取评论和@提醒, 边翻页边返回
+        """
+        return self._pages(lambda cursor: self.get_metions(cursor, cookies_str, proxies), parse_cursor_page("message_list"), '', prefetch=prefetch)
+
     def get_all_metions(self, cookies_str: str, proxies: dict = None):
         """
             获取全部的评论和@提醒
             :param cookies_str: 你的cookies
             返回全部的评论和@提醒
         """
-        cursor = ''
-        metions_list = []
-        try:
-            while True:
-                success, msg, res_json = self.get_metions(cursor, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                metions = res_json["data"]["message_list"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                metions_list.extend(metions)
-                if not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, metions_list
+        return self._collect(self.iter_all_metions(cookies_str, proxies))
 
     def get_likesAndcollects(self, cursor: str, cookies_str: str, proxies: dict = None):
         """
@@ -836,40 +860,25 @@ class XHS_Apis():
                 "cursor": cursor
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('GET', splice_api, cookies_str, proxies=proxies)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
+    def iter_all_likesAndcollects(self, cookies_str: str, proxies: dict = None, prefetch: bool = True):
+        """
+            逐条获取赞和收藏, 边翻页边返回
+        """
+        return self._pages(lambda cursor: self.get_likesAndcollects(cursor, cookies_str, proxies), parse_cursor_page("message_list"), '', prefetch=prefetch)
+
     def get_all_likesAndcollects(self, cookies_str: str, proxies: dict = None):
         """
             获取全部的赞和收藏
             :param cookies_str: 你的cookies
             返回全部的赞和收藏
         """
-        cursor = ''
-        likesAndcollects_list = []
-        try:
-            while True:
-                success, msg, res_json = self.get_likesAndcollects(cursor, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                likesAndcollects = res_json["data"]["message_list"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                likesAndcollects_list.extend(likesAndcollects)
-                if not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, likesAndcollects_list
+        return self._collect(self.iter_all_likesAndcollects(cookies_str, proxies))
 
     def get_new_connections(self, cursor: str, cookies_str: str, proxies: dict = None):
         """
@@ -886,40 +895,25 @@ class XHS_Apis():
                 "cursor": cursor
             }
             splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
-            res_json = response.json()
-            success, msg = res_json["success"], res_json["msg"]
+            return self._request('GET', splice_api, cookies_str, proxies=proxies)
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, res_json
 
+    def iter_all_new_connections(self, cookies_str: str, proxies: dict = None, prefetch: bool = True):
+        """
+            逐条获取新增关注, 边翻页边返回
+        """
+        return self._pages(lambda cursor: self.get_new_connections(cursor, cookies_str, proxies), parse_cursor_page("message_list"), '', prefetch=prefetch)
+
     def get_all_new_connections(self, cookies_str: str, proxies: dict = None):
         """
             获取全部的新增关注
             :param cookies_str: 你的cookies
             返回全部的新增关注
         """
-        cursor = ''
-        connections_list = []
-        try:
-            while True:
-                success, msg, res_json = self.get_new_connections(cursor, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                connections = res_json["data"]["message_list"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                connections_list.extend(connections)
-                if not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, connections_list
+        return self._collect(self.iter_all_new_connections(cookies_str, proxies))
 
     @staticmethod
     def get_note_no_water_video(note_id):
@@ -934,7 +928,7 @@ class XHS_Apis():
         try:
             headers = get_common_headers()
             url = f"https://www.xiaohongshu.com/explore/{note_id}"
-            response = requests.get(url, headers=headers)
+            response = requests.get(url, headers=headers, timeout=get_timeout())
             res = response.text
             video_addr = re.findall(r'<meta name="og:video" content="(.*?)">', res)[0]
         except Exception as e:
@@ -0,0 +1,251 @@
+# encoding: utf-8
+import asyncio
+import functools
+import inspect
+import re
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from apis.xhs_pc_apis import XHS_Apis
+from xhs_utils.cache_util import Response_Cache
+from xhs_utils.limit_util import Rate_Limiter, get_family, is_throttled
+from xhs_utils.metrics_util import get_endpoint, metrics
+from xhs_utils.page_util import Async_Page_Iterator
+from xhs_utils.timeout_util import API_TIMEOUT, check_deadline, get_timeout, remaining
+from xhs_utils.trace_util import tracer
+from xhs_utils.xhs_util import generate_request_params, get_common_headers, parse_url
+from loguru import logger
+
+
+def _mirror(name):
+    """
+        复用 XHS_Apis 中只发一次请求的方法, 这些方法最终都会 return self._request(...)
+        在 AsyncXHS_Apis 里 _request 返回的是协程, 这里统一包装成 async 方法
+    """
+    method = getattr(XHS_Apis, name)
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        res = method(self, *args, **kwargs)
+        if inspect.isawaitable(res):
+            res = await res
+        return res
+    return wrapper
+
+
+"""
+    获小红书的api (asyncio 版本), 方法和返回值与 XHS_Apis 一致, 调用时需要 await
+    iter_* 返回的翻页迭代器用 async for 迭代
+    :param cookies_str: 你的cookies
+"""
+class AsyncXHS_Apis(XHS_Apis):
+    def __init__(self, limit_per_host: int = 10, sign_threads: int = 4, rate_limit: bool = True, limiter: Rate_Limiter = None, throttle_retries: int = 2,
+                 cache: Response_Cache = None, timeout: tuple = API_TIMEOUT, base_url: str = None):
+        """
+            :param limit_per_host: 每个 host 同时进行的请求数量上限
+            :param sign_threads: 等待签名进程的线程数, 签名本身在 node 进程里完成, 不会阻塞事件循环
+            :param rate_limit, limiter, throttle_retries, cache, timeout, base_url: 同 XHS_Apis, 对冲请求和录制只在同步版本里支持
+        """
+        super().__init__(pool_size=limit_per_host, rate_limit=rate_limit, limiter=limiter, throttle_retries=throttle_retries, cache=cache, timeout=timeout, base_url=base_url)
+        self.limit_per_host = limit_per_host
+        self.sign_executor = ThreadPoolExecutor(max_workers=sign_threads, thread_name_prefix='xhs_sign')
+        self.session = None
+        self.semaphores = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.sign_executor.shutdown(wait=False)
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host)
+            # cookies 每次请求单独传入, 不保存响应里的 set-cookie
+            self.session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+        return self.session
+
+    def _get_semaphore(self, url: str):
+        host = urllib.parse.urlparse(url).netloc
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.limit_per_host)
+        return self.semaphores[host]
+
+    @staticmethod
+    def _trans_proxies(proxies: dict = None):
+        if not proxies:
+            return None
+        return proxies.get('https') or proxies.get('http')
+
+    def _client_timeout(self):
+        connect, read = get_timeout(self.timeout)
+        # total 是整个请求的时间上限, 只在设置了截止时间时限制
+        return aiohttp.ClientTimeout(total=remaining(), sock_connect=connect, sock_read=read)
+
+    async def _request(self, method: str, api: str, cookies_str: str, data=None, proxies: dict = None):
+        res_json = None
+        endpoint = get_endpoint(api)
+        try:
+            url = self.base_url + api
+            for attempt in range(self.throttle_retries + 1):
+                if self.limiter is not None:
+                    wait = self.limiter.reserve(api)
+                    if wait > 0:
+                        with tracer.span('rate_limit'):
+                            await asyncio.sleep(wait)
+                check_deadline()
+                async with self._get_semaphore(url):
+                    loop = asyncio.get_running_loop()
+                    headers, cookies, trans_data = await loop.run_in_executor(self.sign_executor, generate_request_params, cookies_str, api, data if data else '')
+                    headers['cookie'] = '; '.join(f'{k}={v}' for k, v in cookies.items())
+                    session = self._get_session()
+                    timeout = self._client_timeout()
+                    start = time.monotonic()
+                    try:
+                        with metrics.timer('xhs_api_request_seconds', gauge='xhs_api_in_flight', endpoint=endpoint), tracer.span('http', endpoint=endpoint):
+                            if method == 'GET':
+                                response = await session.get(url, headers=headers, proxy=self._trans_proxies(proxies), timeout=timeout)
+                            else:
+                                response = await session.post(url, headers=headers, data=trans_data.encode('utf-8'), proxy=self._trans_proxies(proxies), timeout=timeout)
+                            async with response:
+                                status = response.status
+                                try:
+                                    res_json = await response.json(content_type=None)
+                                except ValueError:
+                                    res_json = None
+                    except Exception as e:
+                        metrics.inc('xhs_api_requests_total', endpoint=endpoint, status=type(e).__name__)
+                        raise
+                    metrics.inc('xhs_api_requests_total', endpoint=endpoint, status=status)
+                    self.latency.add(get_family(api), time.monotonic() - start)
+                if self.limiter is None or not self.limiter.feedback(api, is_throttled(status, res_json)):
+                    break
+            if res_json is None:
+                raise Exception(f'http {status}')
+            success, msg = res_json["success"], res_json["msg"]
+        except asyncio.TimeoutError:
+            success = False
+            msg = '请求超时'
+        except Exception as e:
+            success = False
+            msg = str(e)
+        if not success:
+            metrics.inc('xhs_api_errors_total', endpoint=endpoint, code=res_json.get('code', 'unknown') if isinstance(res_json, dict) else 'exception')
+        return success, msg, res_json
+
+    async def _cached(self, endpoint: str, params, use_cache: bool, request):
+        if self.cache is None:
+            return await request()
+        if use_cache:
+            res_json = self.cache.get(endpoint, params)
+            if res_json is not None:
+                return True, res_json.get("msg", "success"), res_json
+        success, msg, res_json = await request()
+        if success:
+            self.cache.set(endpoint, params, res_json)
+        return success, msg, res_json
+
+    def _pages(self, fetch, parse, state, limit: int = None, prefetch: bool = True):
+        return Async_Page_Iterator(fetch, parse, state, limit, prefetch)
+
+    async def _collect(self, pages):
+        item_list = [item async for item in pages]
+        return pages.success, pages.msg, item_list
+
+    get_homefeed_all_channel = _mirror('get_homefeed_all_channel')
+    get_homefeed_recommend = _mirror('get_homefeed_recommend')
+    get_user_info = _mirror('get_user_info')
+    get_user_self_info = _mirror('get_user_self_info')
+    get_user_self_info2 = _mirror('get_user_self_info2')
+    get_user_note_info = _mirror('get_user_note_info')
+    get_user_like_note_info = _mirror('get_user_like_note_info')
+    get_user_collect_note_info = _mirror('get_user_collect_note_info')
+    get_note_info = _mirror('get_note_info')
+    get_search_keyword = _mirror('get_search_keyword')
+    search_note = _mirror('search_note')
+    search_user = _mirror('search_user')
+    get_note_out_comment = _mirror('get_note_out_comment')
+    get_note_inner_comment = _mirror('get_note_inner_comment')
+    get_unread_message = _mirror('get_unread_message')
+    get_metions = _mirror('get_metions')
+    get_likesAndcollects = _mirror('get_likesAndcollects')
+    get_new_connections = _mirror('get_new_connections')
+
+    async def get_note_all_inner_comment(self, comment: dict, xsec_token: str, cookies_str: str, proxies: dict = None):
+        try:
+            if not comment['sub_comment_has_more']:
+                return True, 'success', comment
+            success, msg, inner_comment_list = await self._collect(self.iter_note_all_inner_comment(comment, xsec_token, cookies_str, proxies))
+            if not success:
+                raise Exception(msg)
+            comment['sub_comments'].extend(inner_comment_list)
+        except Exception as e:
+            success = False
+            msg = str(e)
+        return success, msg, comment
+
+    async def get_note_all_comment(self, url: str, cookies_str: str, proxies: dict = None, max_workers: int = 8):
+        out_comment_list = []
+        tasks = []
+        try:
+            note_id, kvDist = parse_url(url)
+            # 一级评论边翻页边展开二级评论, 同时展开的数量不超过 max_workers, 总的请求并发仍由 limit_per_host 控制
+            semaphore = asyncio.Semaphore(max_workers)
+
+            async def expand(comment):
+                async with semaphore:
+                    return await self.get_note_all_inner_comment(comment, kvDist['xsec_token'], cookies_str, proxies)
+
+            pages = self.iter_note_all_out_comment(note_id, kvDist['xsec_token'], cookies_str, proxies)
+            try:
+                async for comment in pages:
+                    out_comment_list.append(comment)
+                    if comment['sub_comment_has_more']:
+                        tasks.append(asyncio.ensure_future(expand(comment)))
+                if not pages.success:
+                    raise Exception(pages.msg)
+                for success, msg, new_comment in await asyncio.gather(*tasks):
+                    if not success:
+                        raise Exception(msg)
+            finally:
+                for task in tasks:
+                    task.cancel()
+            success, msg = True, 'success'
+        except Exception as e:
+            success = False
+            msg = str(e)
+        return success, msg, out_comment_list
+
+    async def get_note_no_water_video(self, note_id):
+        success = True
+        msg = '成功'
+        video_addr = None
+        try:
+            headers = get_common_headers()
+            url = f"https://www.xiaohongshu.com/explore/{note_id}"
+            async with self._get_semaphore(url):
+                async with self._get_session().get(url, headers=headers, timeout=self._client_timeout()) as response:
+                    res = await response.text()
+            video_addr = re.findall(r'<meta name="og:video" content="(.*?)">', res)[0]
+        except Exception as e:
+            success = False
+            msg = str(e)
+        return success, msg, video_addr
+
+
+if __name__ == '__main__':
+    async def main():
+        async with AsyncXHS_Apis() as xhs_apis:
+            cookies_str = r''
+            user_url = 'https://www.xiaohongshu.com/user/profile/67a332a2000000000d008358?xsec_token=ABTf9yz4cLHhTycIlksF0jOi1yIZgfcaQ6IXNNGdKJ8xg=&xsec_source=pc_feed'
+            success, msg, note_list = await xhs_apis.get_user_all_notes(user_url, cookies_str)
+            logger.info(f'获取用户所有笔记结果 {len(note_list)}: {success}, msg: {msg}')
+
+    asyncio.run(main())
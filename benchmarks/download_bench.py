@@ -0,0 +1,99 @@
+"""
+    视频下载基准测试: 原来的单连接 iter_content 循环 vs 分段多连接下载
+    在本地起一个限速的 http 服务 (每个连接单独限速, 模拟 CDN 单连接吞吐上限), 不访问外网
+    python benchmarks/download_bench.py --size 64 --rate 4 --segments 2 4 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from xhs_utils.data_util import write_segmented
+
+
+def make_handler(data, rate):
+    class Throttled_Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            start, end = 0, len(data) - 1
+            range_header = self.headers.get('Range')
+            if range_header:
+                first, last = range_header.split('=')[1].split('-')
+                start = int(first)
+                end = int(last) if last else len(data) - 1
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            chunk = 64 * 1024
+            pos = start
+            begin = time.time()
+            try:
+                while pos <= end:
+                    block = data[pos:min(pos + chunk, end + 1)]
+                    self.wfile.write(block)
+                    pos += len(block)
+                    # 按每个连接的速率限速
+                    ahead = (pos - start) / rate - (time.time() - begin)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+    return Throttled_Handler
+
+
+def baseline(url, file_path):
+    # 原来 download_media 里的视频下载循环
+    res = requests.get(url, stream=True)
+    size = 0
+    chunk_size = 1024 * 1024
+    with open(file_path, mode="wb") as f:
+        for data in res.iter_content(chunk_size=chunk_size):
+            f.write(data)
+            size += len(data)
+    return size
+
+
+def run(name, fn, size):
+    begin = time.time()
+    fn()
+    cost = time.time() - begin
+    print(f'{name:<24}{cost:>8.2f}s{size / cost / 1024 / 1024:>10.2f}MB/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=64, help='文件大小 MB')
+    parser.add_argument('--rate', type=float, default=4, help='单连接限速 MB/s')
+    parser.add_argument('--segments', type=int, nargs='+', default=[2, 4, 8])
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * 1024 * 1024)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(data, args.rate * 1024 * 1024))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/video.mp4'
+
+    print(f'文件 {args.size}MB, 单连接限速 {args.rate}MB/s')
+    print(f'{"mode":<24}{"time":>9}{"speed":>12}')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run('iter_content (baseline)', lambda: baseline(url, os.path.join(tmp_dir, 'baseline.mp4')), len(data))
+        session = requests.Session()
+        for segments in args.segments:
+            file_path = os.path.join(tmp_dir, f'segmented_{segments}.mp4')
+            run(f'segmented x{segments}', lambda: write_segmented(session, url, file_path, segments, threshold=0), len(data))
+            with open(file_path, mode='rb') as f:
+                assert f.read() == data, f'segmented x{segments} 内容不一致'
+    server.shutdown()
@@ -1,15 +1,83 @@
+import argparse
+import asyncio
+import functools
 import json
 import os
+import threading
 from loguru import logger
 from apis.xhs_pc_apis import XHS_Apis
+from apis.xhs_pc_async_apis import AsyncXHS_Apis
 from xhs_utils.common_util import init
-from xhs_utils.data_util import handle_note_info, download_note, save_to_xlsx
+from xhs_utils.data_util import handle_note_info, handle_comment_info, download_note
+from xhs_utils.download_util import Media_Downloader
+from xhs_utils.metrics_util import metrics
+from xhs_utils.pipeline_util import Pipeline
+from xhs_utils.replay_util import Recorder
+from xhs_utils.state_util import Crawl_State, get_note_id
+from xhs_utils.sink_util import get_sink_choices, get_media_choice, need_file_name, open_sink, Multi_Sink
+from xhs_utils.timeout_util import bind, deadline
+from xhs_utils.trace_util import start_profile, tracer
+from xhs_utils.xhs_util import parse_url
+
+# 增量同步时每个用户记录的最新笔记数量
+USER_MARK_SIZE = 5
+
+
+def spider_job(method):
+    """
+        整个任务在 self.job_timeout 秒内结束, 超时后还没发出的请求和下载直接失败
+        打开 tracer 时任务结束后输出各阶段的耗时
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with deadline(self.job_timeout), tracer.job(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def async_spider_job(method):
+    """
+        spider_job 的 asyncio 版本, 截止时间和任务统计随 context 带到 gather 的 task 里, 交给线程池的函数需要用 bind 包装
+    """
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        with deadline(self.job_timeout), tracer.job(method.__name__):
+            return await method(self, *args, **kwargs)
+    return wrapper
 
 
 class Data_Spider():
-    def __init__(self):
-        self.xhs_apis = XHS_Apis()
+    def __init__(self, max_workers: int = 1, media_workers: int = 16, media_per_host: int = 8, video_segments: int = 1, refresh: bool = False,
+                 job_timeout: float = None, hedge_percentile: float = None, base_url: str = None, cdn_url: str = None, recorder: Recorder = None):
+        """
+            :param max_workers: 并发获取笔记详情的线程数, 1 为串行; 签名进程数通过 XHS_SIGN_WORKERS 设置
+            :param media_workers: 媒体下载的线程数
+            :param media_per_host: 每个 CDN host 的并发连接数
+            :param video_segments: 大视频分段下载的连接数, 1 为单连接; 传入 recorder 时固定为 1
+            :param refresh: 为 True 时重新爬取之前已经爬取过的笔记
+            :param job_timeout: 每个 spider_* 任务的总时间上限 (秒), None 为不限制
+            :param hedge_percentile: GET 请求超过该分位数的响应时间后再发一个相同的请求, 取先返回的结果, None 为不对冲
+            :param base_url, cdn_url: 接口和媒体的地址, 离线测试时指向 Replay_Server, 默认为环境变量 XHS_BASE_URL / XHS_CDN_URL
+            :param recorder: 录制接口和媒体的请求, 用于 Replay_Server 回放
+        """
+        self.max_workers = max_workers
+        self.refresh = refresh
+        self.job_timeout = job_timeout
+        self.crawl_states = {}
+        self.xhs_apis = XHS_Apis(pool_size=max(10, max_workers), hedge_percentile=hedge_percentile, base_url=base_url, recorder=recorder)
+        self.downloader = Media_Downloader(max_workers=media_workers, per_host=media_per_host, video_segments=video_segments, cdn_url=cdn_url, recorder=recorder)
 
+    def get_crawl_state(self, base_path: dict):
+        """
+            已爬取笔记的记录, 保存在 media 目录旁边的 crawl_state.db
+        """
+        media_path = base_path['media']
+        if media_path not in self.crawl_states:
+            db_path = os.path.join(os.path.dirname(os.path.abspath(media_path)), 'crawl_state.db')
+            self.crawl_states[media_path] = Crawl_State(db_path, media_path)
+        return self.crawl_states[media_path]
+
+    @spider_job
     def spider_note(self, note_url: str, cookies_str: str, proxies=None):
         """
         爬取一个笔记的信息
@@ -23,61 +91,157 @@ class Data_Spider():
             if success:
                 note_info = note_info['data']['items'][0]
                 note_info['url'] = note_url
-                note_info = handle_note_info(note_info)
+                with tracer.span('handle_note_info'):
+                    note_info = handle_note_info(note_info)
         except Exception as e:
             success = False
             msg = e
         logger.info(f'爬取笔记信息 {note_url}: {success}, msg: {msg}')
         return success, msg, note_info
 
-    def spider_some_note(self, notes: list, cookies_str: str, base_path: dict, save_choice: str, excel_name: str = '', proxies=None):
+    @spider_job
+    def spider_some_note(self, notes: list, cookies_str: str, base_path: dict, save_choice: str, excel_name: str = '', proxies=None, refresh: bool = None):
         """
         爬取一些笔记的信息
         :param notes:
         :param cookies_str:
         :param base_path:
-        :return:
+        :param refresh: 是否重新爬取已经爬取过的笔记, 默认使用 Data_Spider 的 refresh
+        只有 info.json 和全部媒体文件都保存成功的笔记才记为已爬取, 只在保存媒体时跳过已爬取的笔记
+        :return: 没有完成的笔记id (获取详情, 处理或者下载媒体失败)
         """
-        if (save_choice == 'all' or save_choice == 'excel') and excel_name == '':
+        sink_choices = get_sink_choices(save_choice)
+        media_choice = get_media_choice(save_choice)
+        if need_file_name(sink_choices) and excel_name == '':
             raise ValueError('excel_name 不能为空')
-        note_list = []
-        for note_url in notes:
-            success, msg, note_info = self.spider_note(note_url, cookies_str, proxies)
-            if note_info is not None and success:
-                note_list.append(note_info)
-        for note_info in note_list:
-            if save_choice == 'all' or 'media' in save_choice:
-                download_note(note_info, base_path['media'], save_choice)
-        if save_choice == 'all' or save_choice == 'excel':
-            file_path = os.path.abspath(os.path.join(base_path['excel'], f'{excel_name}.xlsx'))
-            save_to_xlsx(note_list, file_path)
+        refresh = self.refresh if refresh is None else refresh
+        crawl_state = self.get_crawl_state(base_path)
+        if media_choice and not refresh:
+            # 已经爬取过的笔记在签名和请求之前跳过
+            new_notes = [note_url for note_url in notes if not crawl_state.contains(get_note_id(note_url))]
+            if len(new_notes) != len(notes):
+                logger.info(f'跳过已爬取的笔记 {len(notes) - len(new_notes)} 条, 剩余 {len(new_notes)} 条')
+            notes = new_notes
+        failed = set()
+        # 提交了媒体下载的笔记, 每个笔记的 on_done 调用一次 media_done.release()
+        media_notes = []
+        media_done = threading.Semaphore(0)
+
+        def fetch(note_url):
+            try:
+                success, msg, note_info = self.xhs_apis.get_note_info(note_url, cookies_str, proxies)
+                if success:
+                    note_info = note_info['data']['items'][0]
+                    note_info['url'] = note_url
+                    return note_info
+            except Exception as e:
+                success = False
+                msg = e
+            failed.add(get_note_id(note_url))
+            logger.info(f'爬取笔记信息 {note_url}: {success}, msg: {msg}')
+            return None
+
+        def handle(note_info):
+            note_url = note_info['url']
+            try:
+                with tracer.span('handle_note_info'):
+                    note_info = handle_note_info(note_info)
+                success, msg = True, '成功'
+            except Exception as e:
+                note_info = None
+                success, msg = False, e
+                failed.add(get_note_id(note_url))
+            logger.info(f'爬取笔记信息 {note_url}: {success}, msg: {msg}')
+            return note_info
 
+        def save_media_stage(note_info):
+            # 媒体文件提交给下载引擎, 下载引擎排队的任务太多时这里会阻塞
+            note_id = note_info['note_id']
+
+            def on_done(success):
+                # 有文件下载失败 (如链接过期) 的笔记不记录, 下次重新获取笔记详情
+                if success:
+                    crawl_state.add(note_id)
+                else:
+                    failed.add(note_id)
+                media_done.release()
+            try:
+                download_note(note_info, base_path['media'], media_choice, self.downloader, on_done)
+            except Exception:
+                failed.add(note_id)
+                raise
+            media_notes.append(note_id)
+            return note_info
+
+        # 获取详情 -> 处理 -> 下载媒体 -> 导出 同时进行, 阶段之间是有界队列
+        pipeline = Pipeline(queue_size=max(32, self.max_workers * 2))
+        pipeline.add_stage('fetch', fetch, workers=self.max_workers)
+        pipeline.add_stage('handle', handle)
+        if media_choice:
+            self.downloader.reset_stats()
+            pipeline.add_stage('media', save_media_stage, workers=2)
+        writer = None
+        if sink_choices:
+            # 边爬边写入 excel / jsonl / csv / parquet, 不在内存里保留全部笔记
+            writer = Multi_Sink([open_sink(kind, base_path['excel'], excel_name, 'note') for kind in sink_choices])
+
+        def sink(note_info):
+            if writer is not None:
+                with tracer.span('export'):
+                    writer.write(note_info)
+
+        try:
+            pipeline.run(notes, sink=sink)
+        finally:
+            if writer is not None:
+                writer.close()
+        if media_choice:
+            self.downloader.wait()
+            # on_done 在下载任务的回调里调用, 可能比 wait 返回稍晚
+            for _ in media_notes:
+                media_done.acquire()
+        return failed
 
-    def spider_user_all_note(self, user_url: str, cookies_str: str, base_path: dict, save_choice: str, excel_name: str = '', proxies=None):
+    @spider_job
+    def spider_user_all_note(self, user_url: str, cookies_str: str, base_path: dict, save_choice: str, excel_name: str = '', proxies=None, incremental: bool = False):
         """
         爬取一个用户的所有笔记
         :param user_url:
         :param cookies_str:
         :param base_path:
+        :param incremental: 增量同步, 只翻页到上次同步过的最新笔记为止, refresh 时不生效
         :return:
         """
         note_list = []
         try:
-            success, msg, all_note_info = self.xhs_apis.get_user_all_notes(user_url, cookies_str, proxies)
+            user_id = user_url.split('/')[-1].split('?')[0]
+            crawl_state = self.get_crawl_state(base_path)
+            incremental = incremental and not self.refresh
+            known_note_ids = crawl_state.get_user_mark(user_id) if incremental else None
+            success, msg, all_note_info = self.xhs_apis.get_user_all_notes(user_url, cookies_str, proxies, known_note_ids)
             if success:
                 logger.info(f'用户 {user_url} 作品数量: {len(all_note_info)}')
                 for simple_note_info in all_note_info:
                     note_url = f"https://www.xiaohongshu.com/explore/{simple_note_info['note_id']}?xsec_token={simple_note_info['xsec_token']}"
                     note_list.append(note_url)
-            if save_choice == 'all' or save_choice == 'excel':
-                excel_name = user_url.split('/')[-1].split('?')[0]
-            self.spider_some_note(note_list, cookies_str, base_path, save_choice, excel_name, proxies)
+            if get_sink_choices(save_choice):
+                excel_name = user_id
+            failed = self.spider_some_note(note_list, cookies_str, base_path, save_choice, excel_name, proxies)
+            if success and incremental:
+                newest = [note['note_id'] for note in all_note_info if not note.get('interact_info', {}).get('sticky', False)]
+                # 下次增量同步翻页到标记就停止, 标记只能放在最旧的没有完成的笔记之后 (更旧的位置), 最旧的新笔记没有完成时保留上次的标记
+                failed_index = [index for index, note_id in enumerate(newest) if note_id in failed]
+                if failed_index:
+                    logger.info(f'用户 {user_url} 有 {len(failed)} 条笔记没有完成, 增量同步的标记不越过它们')
+                    newest = newest[failed_index[-1] + 1:]
+                crawl_state.set_user_mark(user_id, (newest + [note_id for note_id in known_note_ids if note_id not in newest])[:USER_MARK_SIZE])
         except Exception as e:
             success = False
             msg = e
         logger.info(f'爬取用户所有视频 {user_url}: {success}, msg: {msg}')
         return note_list, success, msg
 
+    @spider_job
     def spider_some_search_note(self, query: str, require_num: int, cookies_str: str, base_path: dict, save_choice: str, sort_type_choice=0, note_type=0, note_time=0, note_range=0, pos_distance=0, geo: dict = None,  excel_name: str = '', proxies=None):
         """
             指定数量搜索笔记，设置排序方式和笔记类型和笔记数量
@@ -101,7 +265,7 @@ class Data_Spider():
                 for note in notes:
                     note_url = f"https://www.xiaohongshu.com/explore/{note['id']}?xsec_token={note['xsec_token']}"
                     note_list.append(note_url)
-            if save_choice == 'all' or save_choice == 'excel':
+            if get_sink_choices(save_choice):
                 excel_name = query
             self.spider_some_note(note_list, cookies_str, base_path, save_choice, excel_name, proxies)
         except Exception as e:
@@ -110,6 +274,178 @@ class Data_Spider():
         logger.info(f'搜索关键词 {query} 笔记: {success}, msg: {msg}')
         return note_list, success, msg
 
+    @spider_job
+    def spider_note_comment(self, note_url: str, cookies_str: str, base_path: dict, save_choice: str = 'excel', excel_name: str = '', proxies=None, max_workers: int = 8):
+        """
+        爬取一个笔记的所有评论, 边翻页边写入, 不在内存里保留整棵评论树
+        二级评论的 parent_comment_id 为所属的一级评论id
+        :param note_url: 笔记链接, 需要带上 xsec_token
+        :param save_choice: excel / jsonl / csv / parquet / sqlite, 可以用 + 组合
+        :param excel_name: 文件名, 默认为 {note_id}_comments
+        :param max_workers: 同时展开二级评论的线程数
+        :return: 写入的评论数量, success, msg; 有二级评论没有爬完或者处理出错时 success 为 False, 已经拿到的评论仍然写入
+        """
+        sink_choices = get_sink_choices(save_choice)
+        if not sink_choices:
+            raise ValueError(f'save_choice 中没有导出格式: {save_choice}')
+        note_id, query = parse_url(note_url)
+        xsec_token = query.get('xsec_token', '')
+        excel_name = excel_name or f'{note_id}_comments'
+
+        errors = []
+
+        def expand(comment):
+            # 一条一级评论和它的全部二级评论, 在线程池里并发展开
+            try:
+                replies = list(comment['sub_comments'])
+                if comment['sub_comment_has_more']:
+                    pages = self.xhs_apis.iter_note_all_inner_comment(comment, xsec_token, cookies_str, proxies)
+                    replies.extend(pages)
+                    if not pages.success:
+                        errors.append(f'二级评论 {comment["id"]}: {pages.msg}')
+                        logger.warning(f'爬取二级评论 {comment["id"]}: {pages.success}, msg: {pages.msg}')
+                rows = []
+                for data in [comment] + replies:
+                    try:
+                        data['note_url'] = note_url
+                        data['parent_comment_id'] = '' if data is comment else comment['id']
+                        rows.append(handle_comment_info(data))
+                    except Exception as e:
+                        errors.append(f'评论 {data.get("id")}: {e!r}')
+                        logger.warning(f'处理评论 {data.get("id")} 出错: {e!r}')
+                return rows
+            except Exception as e:
+                errors.append(f'一级评论 {comment.get("id")}: {e!r}')
+                logger.warning(f'展开一级评论 {comment.get("id")} 出错: {e!r}')
+                return None
+
+        writer = Multi_Sink([open_sink(kind, base_path['excel'], excel_name, 'comment') for kind in sink_choices])
+        count = 0
+
+        def sink(rows):
+            nonlocal count
+            with tracer.span('export'):
+                for row in rows:
+                    writer.write(row)
+            count += len(rows)
+
+        # 一级评论翻页 -> 展开二级评论 -> 写入, 阶段之间是有界队列, 内存占用和评论总数无关
+        # 层级由 parent_comment_id 表示, 先展开完的先写入, 不用等前面二级评论多的一级评论
+        pages = self.xhs_apis.iter_note_all_out_comment(note_id, xsec_token, cookies_str, proxies)
+        pipeline = Pipeline(queue_size=max(32, max_workers * 2))
+        pipeline.add_stage('expand', expand, workers=max_workers)
+        try:
+            pipeline.run(pages, sink=sink, ordered=False)
+        finally:
+            writer.close()
+        success, msg = pages.success, pages.msg
+        if errors:
+            success = False
+            msg = f'{len(errors)} 处出错: ' + '; '.join(errors[:5]) + (' ...' if len(errors) > 5 else '') + ('' if pages.success else f'; {pages.msg}')
+        logger.info(f'爬取笔记评论 {note_url}: {success}, msg: {msg}, 评论数量: {count}')
+        return count, success, msg
+
+
+class Async_Data_Spider():
+    """
+        Data_Spider 的 asyncio 版本, 基于 AsyncXHS_Apis, 参数和返回值一致, 调用时需要 await
+        笔记详情并发获取, 并发量由 AsyncXHS_Apis 的 limit_per_host 控制
+    """
+    def __init__(self, xhs_apis: AsyncXHS_Apis = None, job_timeout: float = None):
+        """
+            :param job_timeout: 每个 spider_* 任务的总时间上限 (秒), None 为不限制
+        """
+        self.xhs_apis = xhs_apis if xhs_apis is not None else AsyncXHS_Apis()
+        self.job_timeout = job_timeout
+
+    async def close(self):
+        await self.xhs_apis.close()
+
+    @async_spider_job
+    async def spider_note(self, note_url: str, cookies_str: str, proxies=None):
+        note_info = None
+        try:
+            success, msg, note_info = await self.xhs_apis.get_note_info(note_url, cookies_str, proxies)
+            if success:
+                note_info = note_info['data']['items'][0]
+                note_info['url'] = note_url
+                with tracer.span('handle_note_info'):
+                    note_info = handle_note_info(note_info)
+        except Exception as e:
+            success = False
+            msg = e
+        logger.info(f'爬取笔记信息 {note_url}: {success}, msg: {msg}')
+        return success, msg, note_info
+
+    @async_spider_job
+    async def spider_some_note(self, notes: list, cookies_str: str, base_path: dict, save_choice: str, excel_name: str = '', proxies=None):
+        sink_choices = get_sink_choices(save_choice)
+        media_choice = get_media_choice(save_choice)
+        if need_file_name(sink_choices) and excel_name == '':
+            raise ValueError('excel_name 不能为空')
+        results = await asyncio.gather(*[self.spider_note(note_url, cookies_str, proxies) for note_url in notes])
+        note_list = [note_info for success, msg, note_info in results if note_info is not None and success]
+        loop = asyncio.get_running_loop()
+        # 文件读写和媒体下载是阻塞的, 放到线程池里执行, bind 把截止时间带过去
+        if media_choice:
+            for note_info in note_list:
+                # 一个笔记的媒体下载失败 (如链接过期) 不影响其他笔记和导出
+                try:
+                    await loop.run_in_executor(None, bind(download_note), note_info, base_path['media'], media_choice)
+                except Exception as e:
+                    logger.warning(f'保存笔记媒体 {note_info["note_id"]} 出错: {e!r}')
+        if sink_choices:
+            await loop.run_in_executor(None, bind(self._save), note_list, sink_choices, base_path['excel'], excel_name)
+
+    @staticmethod
+    def _save(note_list, sink_choices, dir_path, name):
+        writer = Multi_Sink([open_sink(kind, dir_path, name, 'note') for kind in sink_choices])
+        try:
+            with tracer.span('export'):
+                for note_info in note_list:
+                    writer.write(note_info)
+        finally:
+            writer.close()
+
+    @async_spider_job
+    async def spider_user_all_note(self, user_url: str, cookies_str: str, base_path: dict, save_choice: str, excel_name: str = '', proxies=None):
+        note_list = []
+        try:
+            success, msg, all_note_info = await self.xhs_apis.get_user_all_notes(user_url, cookies_str, proxies)
+            if success:
+                logger.info(f'用户 {user_url} 作品数量: {len(all_note_info)}')
+                for simple_note_info in all_note_info:
+                    note_url = f"https://www.xiaohongshu.com/explore/{simple_note_info['note_id']}?xsec_token={simple_note_info['xsec_token']}"
+                    note_list.append(note_url)
+            if get_sink_choices(save_choice):
+                excel_name = user_url.split('/')[-1].split('?')[0]
+            await self.spider_some_note(note_list, cookies_str, base_path, save_choice, excel_name, proxies)
+        except Exception as e:
+            success = False
+            msg = e
+        logger.info(f'爬取用户所有视频 {user_url}: {success}, msg: {msg}')
+        return note_list, success, msg
+
+    @async_spider_job
+    async def spider_some_search_note(self, query: str, require_num: int, cookies_str: str, base_path: dict, save_choice: str, sort_type_choice=0, note_type=0, note_time=0, note_range=0, pos_distance=0, geo: dict = None,  excel_name: str = '', proxies=None):
+        note_list = []
+        try:
+            success, msg, notes = await self.xhs_apis.search_some_note(query, require_num, cookies_str, sort_type_choice, note_type, note_time, note_range, pos_distance, geo, proxies)
+            if success:
+                notes = list(filter(lambda x: x['model_type'] == "note", notes))
+                logger.info(f'搜索关键词 {query} 笔记数量: {len(notes)}')
+                for note in notes:
+                    note_url = f"https://www.xiaohongshu.com/explore/{note['id']}?xsec_token={note['xsec_token']}"
+                    note_list.append(note_url)
+            if get_sink_choices(save_choice):
+                excel_name = query
+            await self.spider_some_note(note_list, cookies_str, base_path, save_choice, excel_name, proxies)
+        except Exception as e:
+            success = False
+            msg = e
+        logger.info(f'搜索关键词 {query} 笔记: {success}, msg: {msg}')
+        return note_list, success, msg
+
 if __name__ == '__main__':
     """
         此文件为爬虫的入口文件，可以直接运行
@@ -118,11 +454,31 @@ if __name__ == '__main__':
         感谢star和follow
     """
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--refresh', action='store_true', help='重新爬取之前已经爬取过的笔记')
+    parser.add_argument('--job-timeout', type=float, default=None, help='每个任务的总时间上限 (秒)')
+    parser.add_argument('--metrics', default=None, help='结束时把指标写入该文件, .prom 结尾为 prometheus 格式, 否则为 json')
+    parser.add_argument('--trace', action='store_true', help='输出每个任务各阶段 (签名, http, 处理, 媒体, 导出) 的耗时')
+    parser.add_argument('--trace-file', default=None, help='结束时把各阶段的 span 写成 chrome trace')
+    parser.add_argument('--profile', default=None, help='用 cProfile 分析整个运行过程, 结束时写入该文件')
+    parser.add_argument('--record', default=None, help='把接口和媒体的请求录制到该目录, 用 python -m xhs_utils.replay_util 回放')
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+    if args.trace or args.trace_file:
+        tracer.enable(args.trace_file)
+    if args.profile:
+        start_profile(args.profile)
+
     cookies_str, base_path = init()
-    data_spider = Data_Spider()
+    # max_workers 大于 1 时并发获取笔记详情
+    recorder = Recorder(args.record) if args.record else None
+    data_spider = Data_Spider(max_workers=1, refresh=args.refresh, job_timeout=args.job_timeout, recorder=recorder)
     """
         save_choice: all: 保存所有的信息, media: 保存视频和图片（media-video只下载视频, media-image只下载图片，media都下载）, excel: 保存到excel
-        save_choice 为 excel 或者 all 时，excel_name 不能为空
+        save_choice 也可以是 jsonl / csv / parquet (需要安装 pyarrow) / sqlite, 用 + 组合多个, 如 media+parquet, all+sqlite
+        sqlite 按 note_id 去重, 所有任务写入 excel 目录下的 xhs_data.db
+        save_choice 包含导出格式 (excel / jsonl / csv / parquet / all) 时，excel_name 不能为空
     """
 
 
@@ -135,6 +491,8 @@ if __name__ == '__main__':
     # 2 爬取用户的所有笔记信息 用户链接 如下所示 注意此url会过期！
     user_url = 'https://www.xiaohongshu.com/user/profile/64c3f392000000002b009e45?xsec_token=AB-GhAToFu07JwNk_AMICHnp7bSTjVz2beVIDBwSyPwvM=&xsec_source=pc_feed'
     data_spider.spider_user_all_note(user_url, cookies_str, base_path, 'all')
+    # 每天同步关注的用户时用增量同步, 只请求上次同步之后的新笔记
+    # data_spider.spider_user_all_note(user_url, cookies_str, base_path, 'all', incremental=True)
 
     # 3 搜索指定关键词的笔记
     query = "榴莲"
@@ -150,3 +508,18 @@ if __name__ == '__main__':
     #     "longitude": 116.4207
     # }
     data_spider.spider_some_search_note(query, query_num, cookies_str, base_path, 'all', sort_type_choice, note_type, note_time, note_range, pos_distance, geo=None)
+
+    # 4 爬取笔记的所有评论, 边爬边写入, 二级评论通过 parent_comment_id 关联到一级评论
+    # data_spider.spider_note_comment(notes[0], cookies_str, base_path, 'excel')
+
+    # 5 asyncio 版本, 大批量爬取时使用
+    # async def async_main():
+    #     async_data_spider = Async_Data_Spider(AsyncXHS_Apis(limit_per_host=10), job_timeout=args.job_timeout)
+    #     await async_data_spider.spider_some_note(notes, cookies_str, base_path, 'all', 'test_async')
+    #     await async_data_spider.close()
+    # asyncio.run(async_main())
+
+    if args.metrics:
+        metrics.dump(args.metrics)
+    if recorder is not None:
+        recorder.close()
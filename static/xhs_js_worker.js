@@ -0,0 +1,53 @@
+// 常驻的 js 执行进程, 由 xhs_utils/js_util.py 启动
+// 启动时只加载一次脚本, 之后通过 stdin/stdout 逐行收发 JSON 请求
+// 请求: {"id": 1, "fn": "get_request_headers_params", "args": [...]}
+// 响应: {"id": 1, "result": ...} 或 {"id": 1, "error": "..."}
+const fs = require('fs');
+const path = require('path');
+const vm = require('vm');
+const readline = require('readline');
+const { createRequire } = require('module');
+
+const scriptPath = path.resolve(process.argv[2]);
+const send = (msg) => process.stdout.write(JSON.stringify(msg) + '\n');
+
+// stdout 是通信通道, 脚本里的 console 输出全部转到 stderr
+for (const level of ['log', 'info', 'warn', 'debug', 'error']) {
+    console[level] = (...args) => process.stderr.write(args.join(' ') + '\n');
+}
+
+// 和 PyExecJS 一样把脚本包在函数里执行, 顶层声明不会污染全局
+// require 以脚本所在目录为基准, 这样 static 下的相对路径和项目的 node_modules 都能找到
+const source = fs.readFileSync(scriptPath, 'utf-8');
+const wrapper = vm.runInThisContext(
+    '(function (require, __filename, __dirname) {\n' + source + '\n;return function (name) { return eval(name); };\n})',
+    { filename: scriptPath }
+);
+const lookup = wrapper(createRequire(scriptPath), scriptPath, path.dirname(scriptPath));
+
+const rl = readline.createInterface({ input: process.stdin, terminal: false });
+rl.on('line', async (line) => {
+    if (!line.trim()) {
+        return;
+    }
+    let req;
+    try {
+        req = JSON.parse(line);
+    } catch (e) {
+        send({ id: null, error: 'bad request: ' + e.message });
+        return;
+    }
+    try {
+        const fn = lookup(req.fn);
+        if (typeof fn !== 'function') {
+            throw new Error(req.fn + ' is not a function');
+        }
+        const result = await fn.apply(null, req.args || []);
+        send({ id: req.id, result: result === undefined ? null : result });
+    } catch (e) {
+        send({ id: req.id, error: String(e && e.stack || e) });
+    }
+});
+rl.on('close', () => process.exit(0));
+
+send({ id: 0, result: 'ready' });
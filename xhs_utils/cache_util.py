@@ -0,0 +1,105 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 各接口缓存的秒数
+DEFAULT_TTLS = {
+    'get_homefeed_all_channel': 24 * 3600,
+    'get_search_keyword': 24 * 3600,
+    'get_user_info': 3600,
+    'get_note_info': 600,
+}
+
+
+class Response_Cache():
+    """
+        接口响应缓存, 内存里是带过期时间的 LRU, 可选写入 sqlite 文件, 进程重启后仍然有效
+        缓存的是 json 字符串, 每次取出都是新的对象, 调用方修改返回值不会影响缓存
+        :param max_size: 内存里最多缓存的条数
+        :param ttls: 覆盖各接口的缓存秒数, 如 {'get_note_info': 60}
+        :param disk_path: sqlite 文件路径, 不传时只缓存在内存里
+    """
+    def __init__(self, max_size: int = 1024, ttls: dict = None, disk_path: str = None):
+        self.max_size = max_size
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+        self.conn = None
+        if disk_path is not None:
+            self.conn = sqlite3.connect(disk_path, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            with self.conn:
+                self.conn.execute('CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, value TEXT, expire REAL)')
+
+    @staticmethod
+    def make_key(endpoint: str, params):
+        return endpoint + ':' + json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+    def _put(self, key, value, expire):
+        self.items[key] = (expire, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def get(self, endpoint: str, params):
+        """
+            返回缓存的响应, 没有或者过期时返回 None
+        """
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and item[0] > now:
+                self.items.move_to_end(key)
+                self.stats['hits'] += 1
+                return json.loads(item[1])
+            if item is not None:
+                del self.items[key]
+            if self.conn is not None:
+                row = self.conn.execute('SELECT value, expire FROM response_cache WHERE key = ?', (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    self._put(key, row[0], row[1])
+                    self.stats['disk_hits'] += 1
+                    return json.loads(row[0])
+            self.stats['misses'] += 1
+        return None
+
+    def set(self, endpoint: str, params, value):
+        ttl = self.ttls.get(endpoint)
+        if not ttl:
+            return
+        key = self.make_key(endpoint, params)
+        expire = time.time() + ttl
+        value = json.dumps(value, ensure_ascii=False)
+        with self.lock:
+            self._put(key, value, expire)
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.execute('INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?)', (key, value, expire))
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.execute('DELETE FROM response_cache')
+
+    def purge(self):
+        """
+            删除磁盘上已经过期的缓存
+        """
+        if self.conn is None:
+            return
+        with self.lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM response_cache WHERE expire <= ?', (time.time(),))
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
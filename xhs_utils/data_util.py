@@ -1,11 +1,48 @@
+import contextlib
 import json
+import math
 import os
+import random
 import re
+import tempfile
+import threading
 import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 import openpyxl
 import requests
 from loguru import logger
-from retry import retry
+from xhs_utils.metrics_util import metrics
+from xhs_utils.timeout_util import MEDIA_TIMEOUT, bind, check_deadline, get_timeout, remaining
+from xhs_utils.trace_util import tracer
+
+CONTENT_RANGE_RE = re.compile(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)')
+ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+# excel 单个 sheet 的最大行数
+XLSX_MAX_ROWS = 1048576
+XLSX_HEADERS = {
+    'note': ['笔记id', '笔记url', '笔记类型', '用户id', '用户主页url', '昵称', '头像url', '标题', '描述', '点赞数量', '收藏数量', '评论数量', '分享数量', '视频封面url', '视频地址url', '图片地址url列表', '标签', '上传时间', 'ip归属地'],
+    'user': ['用户id', '用户主页url', '用户名', '头像url', '小红书号', '性别', 'ip地址', '介绍', '关注数量', '粉丝数量', '作品被赞和收藏数量', '标签'],
+    'comment': ['笔记id', '笔记url', '评论id', '父评论id', '用户id', '用户主页url', '昵称', '头像url', '评论内容', '评论标签', '点赞数量', '上传时间', 'ip归属地', '图片地址url列表'],
+}
+
+
+class Incomplete_Download(IOError):
+    pass
+
+
+class Expired_Url(IOError):
+    """
+        CDN 返回 403 / 404 / 410, 带签名的链接已经过期, 重试没有意义, 需要重新获取笔记详情
+    """
+    pass
+
+
+def backoff_delay(attempt, base_delay=1, max_delay=30):
+    """
+        带随机抖动的指数退避 (full jitter), attempt 从 0 开始
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
 
 
 def norm_str(str):
@@ -13,7 +50,6 @@ def norm_str(str):
     return new_str
 
 def norm_text(text):
-    ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
     text = ILLEGAL_CHARACTERS_RE.sub(r'', text)
     return text
 
@@ -136,6 +172,8 @@ def handle_comment_info(data):
     note_id = data['note_id']
     note_url = data['note_url']
     comment_id = data['id']
+    # 二级评论所属的一级评论id, 一级评论为空
+    parent_comment_id = data.get('parent_comment_id', '')
     user_id = data['user_info']['user_id']
     home_url = f'https://www.xiaohongshu.com/user/profile/{user_id}'
     nickname = data['user_info']['nickname']
@@ -164,6 +202,7 @@ def handle_comment_info(data):
         'note_id': note_id,
         'note_url': note_url,
         'comment_id': comment_id,
+        'parent_comment_id': parent_comment_id,
         'user_id': user_id,
         'home_url': home_url,
         'nickname': nickname,
@@ -175,35 +214,332 @@ def handle_comment_info(data):
         'ip_location': ip_location,
         'pictures': pictures,
     }
+class Xlsx_Writer():
+    """
+        流式导出 excel, 使用 openpyxl 的 write-only 模式, 行数据写入后不再保留在内存中
+        达到 max_rows 时换到新的 sheet (rollover='sheet') 或新的文件 name_2.xlsx (rollover='file')
+        :param file_path: 保存路径
+        :param type: note / user / comment, 决定表头
+        :param max_rows: 每个 sheet 的最大行数 (包含表头)
+        :param rollover: sheet 或 file
+    """
+    def __init__(self, file_path, type='note', max_rows=XLSX_MAX_ROWS, rollover='sheet'):
+        self.file_path = file_path
+        self.type = type
+        self.headers = XLSX_HEADERS.get(type, XLSX_HEADERS['comment'])
+        self.max_rows = max_rows
+        self.rollover = rollover
+        self.file_index = 1
+        self.sheet_index = 1
+        self.count = 0
+        self.files = []
+        self.wb = None
+        self.ws = None
+        self._new_workbook()
+
+    def _current_path(self):
+        if self.file_index == 1:
+            return self.file_path
+        root, ext = os.path.splitext(self.file_path)
+        return f'{root}_{self.file_index}{ext}'
+
+    def _new_workbook(self):
+        self.wb = openpyxl.Workbook(write_only=True)
+        self.sheet_index = 1
+        self._new_sheet()
+
+    def _new_sheet(self):
+        title = 'Sheet' if self.sheet_index == 1 else f'Sheet{self.sheet_index}'
+        self.ws = self.wb.create_sheet(title)
+        self.ws.append(self.headers)
+        self.rows = 1
+
+    def _save(self):
+        file_path = self._current_path()
+        self.wb.save(file_path)
+        self.files.append(file_path)
+        logger.info(f'数据保存至 {file_path}')
+
+    def write(self, data: dict):
+        if self.rows >= self.max_rows:
+            if self.rollover == 'file':
+                self._save()
+                self.file_index += 1
+                self._new_workbook()
+            else:
+                self.sheet_index += 1
+                self._new_sheet()
+        self.ws.append([norm_text(str(v)) for v in data.values()])
+        self.rows += 1
+        self.count += 1
+
+    def close(self):
+        if self.wb is not None:
+            self._save()
+            self.wb = None
+        return self.files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
 def save_to_xlsx(datas, file_path, type='note'):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    if type == 'note':
-        headers = ['笔记id', '笔记url', '笔记类型', '用户id', '用户主页url', '昵称', '头像url', '标题', '描述', '点赞数量', '收藏数量', '评论数量', '分享数量', '视频封面url', '视频地址url', '图片地址url列表', '标签', '上传时间', 'ip归属地']
-    elif type == 'user':
-        headers = ['用户id', '用户主页url', '用户名', '头像url', '小红书号', '性别', 'ip地址', '介绍', '关注数量', '粉丝数量', '作品被赞和收藏数量', '标签']
-    else:
-        headers = ['笔记id', '笔记url', '评论id', '用户id', '用户主页url', '昵称', '头像url', '评论内容', '评论标签', '点赞数量', '上传时间', 'ip归属地', '图片地址url列表']
-    ws.append(headers)
-    for data in datas:
-        data = {k: norm_text(str(v)) for k, v in data.items()}
-        ws.append(list(data.values()))
-    wb.save(file_path)
-    logger.info(f'数据保存至 {file_path}')
-
-def download_media(path, name, url, type):
-    if type == 'image':
-        content = requests.get(url).content
-        with open(path + '/' + name + '.jpg', mode="wb") as f:
-            f.write(content)
-    elif type == 'video':
-        res = requests.get(url, stream=True)
-        size = 0
-        chunk_size = 1024 * 1024
-        with open(path + '/' + name + '.mp4', mode="wb") as f:
+    with Xlsx_Writer(file_path, type) as writer:
+        for data in datas:
+            writer.write(data)
+
+def write_stream(res, file_path, chunk_size=64 * 1024, fsync=False):
+    """
+        把响应分块写入临时文件, 写完后原子地重命名为 file_path, 返回写入的字节数
+        中途失败不会留下看起来完整的文件
+        :param fsync: 重命名前是否 fsync, 需要断电安全时打开
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=os.path.basename(file_path) + '.', suffix='.tmp')
+    size = 0
+    try:
+        with os.fdopen(fd, mode="wb") as f:
             for data in res.iter_content(chunk_size=chunk_size):
+                check_deadline()
                 f.write(data)
                 size += len(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size
+
+def parse_content_range(content_range):
+    """
+        解析 Content-Range: bytes 100-199/1000 或 bytes */1000, 返回 (start, total), 未知的部分为 None
+    """
+    match = CONTENT_RANGE_RE.match(content_range or '')
+    if not match:
+        return None, None
+    start = int(match.group(1)) if match.group(1) is not None else None
+    total = int(match.group(3)) if match.group(3) != '*' else None
+    return start, total
+
+def write_resumable(session, url, file_path, chunk_size=1024 * 1024, fsync=False, tries=3):
+    """
+        断点续传下载, 数据先写入 file_path.part, 失败或者程序重启后用 Range 从已下载的位置继续
+        完成后校验大小, 再原子地重命名为 file_path, 返回文件大小
+        :param tries: 连接中断时续传的次数
+    """
+    part_path = file_path + '.part'
+    for attempt in range(tries):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        # 视频不需要压缩, 压缩后 Range 和 Content-Length 都对不上
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=get_timeout(MEDIA_TIMEOUT)) as res:
+                if res.status_code == 416:
+                    # .part 已经是完整的文件
+                    start, total = parse_content_range(res.headers.get('Content-Range'))
+                    if total is not None and total == offset:
+                        break
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    if attempt == tries - 1:
+                        raise Incomplete_Download(f'{file_path} 续传位置 {offset} 与文件大小 {total} 不一致')
+                    continue
+                res.raise_for_status()
+                start, total = parse_content_range(res.headers.get('Content-Range'))
+                if res.status_code == 206 and start == offset:
+                    mode = 'ab'
+                else:
+                    # 服务器不支持 Range, 只能从头开始
+                    mode, offset = 'wb', 0
+                    total = int(res.headers['Content-Length']) if 'Content-Length' in res.headers else None
+                if offset:
+                    logger.info(f'断点续传 {file_path} 从 {offset} 字节开始')
+                with open(part_path, mode=mode) as f:
+                    for data in res.iter_content(chunk_size=chunk_size):
+                        check_deadline()
+                        f.write(data)
+                    if fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+            size = os.path.getsize(part_path)
+            if total is not None and size != total:
+                if size > total:
+                    os.remove(part_path)
+                raise Incomplete_Download(f'{file_path} 大小不一致: {size} != {total}')
+            break
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout, Incomplete_Download) as e:
+            if attempt == tries - 1:
+                raise
+            logger.warning(f'下载中断 {file_path}: {e}, 准备续传')
+            time.sleep(backoff_delay(attempt))
+    os.replace(part_path, file_path)
+    return os.path.getsize(file_path)
+
+def probe_size(session, url):
+    """
+        用 Range: bytes=0-0 探测文件大小, 服务器不支持 Range 时返回 None
+    """
+    with session.get(url, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'}, stream=True, timeout=get_timeout(MEDIA_TIMEOUT)) as res:
+        if res.status_code != 206:
+            return None
+        start, total = parse_content_range(res.headers.get('Content-Range'))
+        return total
+
+def download_segment(session, url, file_path, start, end, chunk_size=256 * 1024, tries=3):
+    """
+        下载 [start, end] 这一段并写入 file_path 对应的位置, 中断后从这一段已写入的位置继续
+        每个线程各自打开文件, 有 os.pwrite 时用位置写, 否则 seek 后写入
+    """
+    pos = start
+    with open(file_path, mode='r+b') as f:
+        for attempt in range(tries):
+            try:
+                headers = {'Range': f'bytes={pos}-{end}', 'Accept-Encoding': 'identity'}
+                with session.get(url, headers=headers, stream=True, timeout=get_timeout(MEDIA_TIMEOUT)) as res:
+                    res.raise_for_status()
+                    if res.status_code != 206 or parse_content_range(res.headers.get('Content-Range'))[0] != pos:
+                        raise Incomplete_Download(f'{url} 不支持分段下载')
+                    for data in res.iter_content(chunk_size=chunk_size):
+                        check_deadline()
+                        if hasattr(os, 'pwrite'):
+                            os.pwrite(f.fileno(), data, pos)
+                        else:
+                            f.seek(pos)
+                            f.write(data)
+                        pos += len(data)
+                if pos != end + 1:
+                    raise Incomplete_Download(f'分段 {start}-{end} 不完整, 下载到 {pos}')
+                return end - start + 1
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout, Incomplete_Download) as e:
+                if attempt == tries - 1:
+                    raise
+                logger.warning(f'分段下载中断 {file_path} {start}-{end}: {e}, 从 {pos} 继续')
+                time.sleep(backoff_delay(attempt))
+
+def write_segmented(session, url, file_path, segments=4, threshold=32 * 1024 * 1024, fsync=False):
+    """
+        多连接分段下载, 文件按字节范围切成 segments 段并发下载, 直接写入预分配好的 file_path.seg
+        小于 threshold 或者服务器不支持 Range 时走单连接的 write_resumable
+    """
+    total = probe_size(session, url) if segments > 1 else None
+    if total is None or total < threshold:
+        return write_resumable(session, url, file_path, fsync=fsync)
+    seg_path = file_path + '.seg'
+    segment_size = math.ceil(total / segments)
+    ranges = [(start, min(start + segment_size, total) - 1) for start in range(0, total, segment_size)]
+    try:
+        with open(seg_path, mode='wb') as f:
+            f.truncate(total)
+        with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix='segment') as executor:
+            futures = [executor.submit(bind(download_segment), session, url, seg_path, start, end) for start, end in ranges]
+            for future in futures:
+                future.result()
+        if fsync:
+            with open(seg_path, mode='r+b') as f:
+                os.fsync(f.fileno())
+        os.replace(seg_path, file_path)
+    except BaseException:
+        if os.path.exists(seg_path):
+            os.remove(seg_path)
+        raise
+    return total
+
+def rewrite_cdn_url(url, cdn_url=None):
+    """
+        把媒体链接的 scheme 和 host 换成 cdn_url (默认为环境变量 XHS_CDN_URL), 路径不变, 用于指向 Replay_Server
+    """
+    cdn_url = cdn_url or os.environ.get('XHS_CDN_URL')
+    if not cdn_url:
+        return url
+    parsed = urllib.parse.urlsplit(url)
+    return cdn_url.rstrip('/') + parsed.path + ('?' + parsed.query if parsed.query else '')
+
+def media_file_path(path, name, type):
+    return path + '/' + name + ('.mp4' if type == 'video' else '.jpg')
+
+def download_media(path, name, url, type, session=None, fsync=False, segments=1, segment_threshold=32 * 1024 * 1024, cdn_url=None):
+    """
+        流式下载图片或视频, 返回写入的字节数
+        :param session: 复用连接的 requests.Session, 不传时每次新建连接
+        :param fsync: 写完后是否 fsync
+        :param segments: 视频分段下载的连接数, 1 为单连接
+        :param segment_threshold: 视频大于这个字节数才分段下载
+        :param cdn_url: 替换媒体链接的 host, 见 rewrite_cdn_url
+    """
+    if session is None:
+        session = requests
+    url = rewrite_cdn_url(url, cdn_url)
+    size = 0
+    file_path = media_file_path(path, name, type)
+    try:
+        with metrics.timer('xhs_media_download_seconds', gauge='xhs_media_in_flight', type=type), tracer.span('media', type=type):
+            if type == 'image':
+                with session.get(url, stream=True, timeout=get_timeout(MEDIA_TIMEOUT)) as res:
+                    res.raise_for_status()
+                    size = write_stream(res, file_path, fsync=fsync)
+            elif type == 'video':
+                if segments > 1:
+                    size = write_segmented(session, url, file_path, segments, segment_threshold, fsync=fsync)
+                else:
+                    size = write_resumable(session, url, file_path, fsync=fsync)
+    except Exception as e:
+        metrics.inc('xhs_media_downloads_total', type=type, result=classify_error(e))
+        raise
+    metrics.inc('xhs_media_downloads_total', type=type, result='success')
+    metrics.inc('xhs_media_bytes_total', size, type=type)
+    return size
+
+def classify_error(e):
+    """
+        下载失败的类型: retry 超时, 连接中断, 429 和 5xx, 可以重试
+        expired 403 / 404 / 410, 链接已过期; fail 其他 4xx 和本地错误 (磁盘满等), 直接失败
+    """
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        status = e.response.status_code
+        if status in (403, 404, 410):
+            return 'expired'
+        return 'retry' if status == 429 or status >= 500 else 'fail'
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                      requests.exceptions.Timeout, Incomplete_Download)):
+        return 'retry'
+    return 'fail'
+
+def download_asset(path, name, url, type, tries=4, base_delay=1, max_delay=30, slot=None, **kwargs):
+    """
+        下载单个图片或视频, 失败时只重试这一个文件, 重试间隔为带抖动的指数退避
+        文件已经存在时跳过 (文件都是写完后原子重命名的, 存在就是完整的), 返回写入的字节数
+        :param tries: 最多尝试的次数
+        :param slot: 每次尝试时持有的锁, 如 Media_Downloader 每个 host 的信号量, 退避等待时不占用
+        :param kwargs: 传给 download_media
+    """
+    if os.path.exists(media_file_path(path, name, type)):
+        return 0
+    if slot is None:
+        slot = contextlib.nullcontext()
+    for attempt in range(tries):
+        try:
+            with slot:
+                return download_media(path, name, url, type, **kwargs)
+        except Exception as e:
+            kind = classify_error(e)
+            if kind == 'expired':
+                raise Expired_Url(f'链接已过期 ({e.response.status_code}): {url}') from e
+            if kind == 'fail' or attempt == tries - 1:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            left = remaining()
+            if left is not None and delay >= left:
+                raise
+            logger.warning(f'下载失败 {path}/{name}: {e}, {delay:.1f} 秒后重试')
+            time.sleep(delay)
 
 def save_user_detail(user, path):
     with open(f'{path}/detail.txt', mode="w", encoding="utf-8") as f:
@@ -246,8 +582,35 @@ def save_note_detail(note, path):
 
 
 
-@retry(tries=3, delay=1)
-def download_note(note_info, path, save_choice):
+def when_all_done(futures, callback):
+    """
+        futures 全部完成后调用 callback(是否全部成功), Media_Downloader 的任务返回 False 表示失败
+    """
+    if not futures:
+        callback(True)
+        return
+    left = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            left[0] -= 1
+            if left[0] != 0:
+                return
+        callback(all(not future.cancelled() and future.exception() is None and future.result() is not False for future in futures))
+    for future in futures:
+        future.add_done_callback(done)
+
+def download_note(note_info, path, save_choice, downloader=None, on_done=None):
+    """
+        保存笔记的信息和媒体文件, 每个媒体文件单独重试, 已经下载过的文件跳过
+        :param downloader: Media_Downloader, 传入时媒体文件提交到下载引擎并发下载, 函数不等待下载完成
+        :param on_done: on_done(是否全部成功), info.json 写入且所有媒体文件下载结束后调用; 不传 downloader 时下载失败直接抛出异常
+    """
+    if downloader is None:
+        download = download_asset
+    else:
+        download = downloader.submit
     note_id = note_info['note_id']
     user_id = note_info['user_id']
     title = note_info['title']
@@ -262,12 +625,18 @@ def download_note(note_info, path, save_choice):
         f.write(json.dumps(note_info) + '\n')
     note_type = note_info['note_type']
     save_note_detail(note_info, save_path)
+    results = []
     if note_type == '图集' and save_choice in ['media', 'media-image', 'all']:
         for img_index, img_url in enumerate(note_info['image_list']):
-            download_media(save_path, f'image_{img_index}', img_url, 'image')
+            results.append(download(save_path, f'image_{img_index}', img_url, 'image'))
     elif note_type == '视频' and save_choice in ['media', 'media-video', 'all']:
-        download_media(save_path, 'cover', note_info['video_cover'], 'image')
-        download_media(save_path, 'video', note_info['video_addr'], 'video')
+        results.append(download(save_path, 'cover', note_info['video_cover'], 'image'))
+        results.append(download(save_path, 'video', note_info['video_addr'], 'video'))
+    if on_done is not None:
+        if downloader is None:
+            on_done(True)
+        else:
+            when_all_done(results, on_done)
     return save_path
 
 
@@ -0,0 +1,175 @@
+import json
+import sqlite3
+import threading
+import time
+from loguru import logger
+from xhs_utils.sink_util import FIELDS, COUNT_FIELDS, LIST_FIELDS, trans_row
+
+# 每种数据的主键
+PRIMARY_KEYS = {
+    'note': 'note_id',
+    'user': 'user_id',
+    'comment': 'comment_id',
+}
+# 需要建索引的列
+INDEXES = {
+    'note': ['user_id', 'upload_time'],
+    'user': [],
+    'comment': ['note_id', 'parent_comment_id', 'user_id', 'upload_time'],
+}
+
+
+class XHS_Store():
+    """
+        sqlite 存储, 笔记 / 用户 / 评论分别按 note_id / user_id / comment_id 去重, 重复写入时更新为最新的数据
+        写入先攒在内存里, 每 batch_size 条在一个事务里提交
+        使用 WAL 模式, 爬取写入的同时可以用别的连接查询
+        :param db_path: 数据库文件路径
+        :param batch_size: 多少条提交一次
+    """
+    def __init__(self, db_path: str, batch_size: int = 500):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.pending = {type: [] for type in FIELDS}
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.conn:
+            for type, fields in FIELDS.items():
+                columns = []
+                for field in fields:
+                    column_type = 'INTEGER' if field in COUNT_FIELDS[type] else 'TEXT'
+                    if field == PRIMARY_KEYS[type]:
+                        column_type += ' PRIMARY KEY'
+                    columns.append(f'"{field}" {column_type}')
+                columns.append('crawl_time INTEGER')
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS {type} ({", ".join(columns)})')
+                # 旧版本建的表补上新增的列
+                existing = set(row[1] for row in self.conn.execute(f'PRAGMA table_info({type})'))
+                for field in fields:
+                    if field not in existing:
+                        column_type = 'INTEGER' if field in COUNT_FIELDS[type] else 'TEXT'
+                        self.conn.execute(f'ALTER TABLE {type} ADD COLUMN "{field}" {column_type}')
+                for field in INDEXES[type]:
+                    self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{type}_{field} ON {type} ({field})')
+
+    @staticmethod
+    def _upsert_sql(type):
+        fields = FIELDS[type] + ['crawl_time']
+        columns = ', '.join(f'"{field}"' for field in fields)
+        updates = ', '.join(f'"{field}"=excluded."{field}"' for field in fields if field != PRIMARY_KEYS[type])
+        return (f'INSERT INTO {type} ({columns}) VALUES ({", ".join("?" * len(fields))}) '
+                f'ON CONFLICT({PRIMARY_KEYS[type]}) DO UPDATE SET {updates}')
+
+    @staticmethod
+    def _trans_values(data, type, crawl_time):
+        row = trans_row(data, type)
+        for field in LIST_FIELDS[type]:
+            if row[field] is not None:
+                row[field] = json.dumps(row[field], ensure_ascii=False)
+        return [row[field] for field in FIELDS[type]] + [crawl_time]
+
+    @staticmethod
+    def _trans_data(names, row, type):
+        data = dict(zip(names, row))
+        for field in LIST_FIELDS[type]:
+            if data[field] is not None:
+                data[field] = json.loads(data[field])
+        return data
+
+    def write(self, data: dict, type: str = 'note'):
+        """
+            写入一条数据, 攒够 batch_size 条后提交
+            :param type: note / user / comment
+        """
+        with self.lock:
+            self.pending[type].append(self._trans_values(data, type, int(time.time())))
+            if len(self.pending[type]) >= self.batch_size:
+                self._flush(type)
+
+    def write_many(self, datas: list, type: str = 'note'):
+        for data in datas:
+            self.write(data, type)
+
+    def _flush(self, type):
+        rows = self.pending[type]
+        if not rows:
+            return
+        with self.conn:
+            self.conn.executemany(self._upsert_sql(type), rows)
+        self.pending[type] = []
+
+    def flush(self):
+        with self.lock:
+            for type in self.pending:
+                self._flush(type)
+
+    def query(self, type: str = 'note', user_id: str = None, start_time: str = None, end_time: str = None, limit: int = None):
+        """
+            按用户和发布时间查询, 返回 dict 列表, 按发布时间倒序
+            :param start_time: 发布时间下限, 如 2024-01-01 00:00:00
+            :param end_time: 发布时间上限
+        """
+        self.flush()
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            params.append(user_id)
+        if start_time is not None:
+            conditions.append('upload_time >= ?')
+            params.append(start_time)
+        if end_time is not None:
+            conditions.append('upload_time <= ?')
+            params.append(end_time)
+        sql = f'SELECT * FROM {type}'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY upload_time DESC' if type != 'user' else ''
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            names = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        return [self._trans_data(names, row, type) for row in rows]
+
+    def get(self, key: str, type: str = 'note'):
+        """
+            按主键取一条数据, 不存在时返回 None
+        """
+        self.flush()
+        with self.lock:
+            cursor = self.conn.execute(f'SELECT * FROM {type} WHERE {PRIMARY_KEYS[type]} = ?', (key,))
+            names = [column[0] for column in cursor.description]
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return self._trans_data(names, row, type)
+
+    def close(self):
+        if self.conn is None:
+            return
+        self.flush()
+        self.conn.close()
+        self.conn = None
+        logger.info(f'数据保存至 {self.db_path}')
+
+
+class Sqlite_Sink():
+    """
+        把 XHS_Store 包装成和 Xlsx_Writer 一样的导出目标
+    """
+    def __init__(self, db_path: str, type: str = 'note'):
+        self.store = XHS_Store(db_path)
+        self.type = type
+
+    def write(self, data: dict):
+        self.store.write(data, self.type)
+
+    def close(self):
+        self.store.close()
+        return [self.store.db_path]
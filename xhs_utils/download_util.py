@@ -0,0 +1,143 @@
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait
+from loguru import logger
+from xhs_utils.data_util import download_asset, rewrite_cdn_url, Expired_Url
+from xhs_utils.replay_util import Recorder
+from xhs_utils.session_util import Session_Pool
+from xhs_utils.timeout_util import bind
+
+
+class Media_Downloader():
+    """
+        媒体下载引擎, 多个笔记的图片和视频放在同一个线程池里下载
+        每个 CDN host (sns-webpic-qc, sns-video-bd ...) 单独限制并发连接数
+        :param max_workers: 下载线程数
+        :param per_host: 每个 host 的默认并发连接数
+        :param host_limits: 单独指定某些 host 的并发连接数, 如 {'sns-video-bd.xhscdn.com': 4}
+        :param progress_interval: 输出进度和速度的间隔秒数
+        :param fsync: 文件写完后是否 fsync
+        :param video_segments: 大视频分段下载的连接数, 1 为单连接; 分段的连接不占用 per_host 的名额
+        :param segment_threshold: 视频大于这个字节数才分段下载
+        :param max_pending: 排队中的任务上限, 超过后 submit 阻塞, 默认 max_workers 的 4 倍
+        :param tries: 每个文件最多尝试的次数, 重试间隔为带抖动的指数退避
+        :param cdn_url: 替换媒体链接的 host, 默认为环境变量 XHS_CDN_URL, 离线测试时指向 Replay_Server
+        :param recorder: 录制下载的媒体文件, 用于 Replay_Server 回放; 带 Range 的请求不录制, 传入时视频只用单连接下载
+    """
+    def __init__(self, max_workers: int = 16, per_host: int = 8, host_limits: dict = None, progress_interval: float = 5, fsync: bool = False,
+                 video_segments: int = 1, segment_threshold: int = 32 * 1024 * 1024, max_pending: int = None, tries: int = 4, cdn_url: str = None, recorder: Recorder = None):
+        if recorder is not None and video_segments > 1:
+            logger.warning(f'录制时分段下载的视频无法回放, video_segments 从 {video_segments} 改为 1')
+            video_segments = 1
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.host_limits = host_limits or {}
+        self.progress_interval = progress_interval
+        self.fsync = fsync
+        self.video_segments = video_segments
+        self.segment_threshold = segment_threshold
+        self.tries = tries
+        self.cdn_url = cdn_url
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='media_download')
+        self.sessions = Session_Pool(pool_size=max(per_host, *self.host_limits.values(), 1) * max(video_segments, 1), hooks=[recorder.hook] if recorder is not None else None)
+        self.semaphores = {}
+        self.pending = threading.BoundedSemaphore(max_pending or max_workers * 4)
+        self.lock = threading.Lock()
+        self.futures = set()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.total = 0
+            self.finished = 0
+            self.failed = 0
+            self.bytes = 0
+            self.start_time = time.time()
+            self.last_report = self.start_time
+
+    def _get_semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.host_limits.get(host, self.per_host))
+            return self.semaphores[host]
+
+    def _run(self, download, path, name, url, type):
+        host = urllib.parse.urlparse(url).netloc
+        size = 0
+        success = True
+        try:
+            # host 的名额只在每次尝试时占用, 重试前的退避等待不占用, 不影响同一个 host 的其他下载
+            size = download(path, name, url, type, tries=self.tries, slot=self._get_semaphore(host), session=self.sessions.get(rewrite_cdn_url(url, self.cdn_url)),
+                            fsync=self.fsync, segments=self.video_segments, segment_threshold=self.segment_threshold, cdn_url=self.cdn_url)
+        except Expired_Url as e:
+            success = False
+            logger.warning(f'下载失败 {path}/{name}: {e}, 需要重新获取笔记详情')
+        except Exception as e:
+            success = False
+            logger.warning(f'下载失败 {path}/{name} {url}: {e}')
+        finally:
+            self.pending.release()
+        self._report(success, size or 0)
+        return success
+
+    def _report(self, success, size):
+        with self.lock:
+            self.finished += 1
+            if not success:
+                self.failed += 1
+            self.bytes += size
+            now = time.time()
+            if now - self.last_report < self.progress_interval and self.finished != self.total:
+                return
+            self.last_report = now
+            progress = self.progress()
+        logger.info(f"媒体下载进度 {progress['finished']}/{progress['total']}, 失败 {progress['failed']}, "
+                    f"已下载 {progress['bytes'] / 1024 / 1024:.1f}MB, 速度 {progress['speed'] / 1024 / 1024:.2f}MB/s")
+
+    def progress(self):
+        """
+            返回当前的进度和平均速度 (字节/秒)
+        """
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        return {
+            'total': self.total,
+            'finished': self.finished,
+            'failed': self.failed,
+            'bytes': self.bytes,
+            'speed': self.bytes / elapsed,
+        }
+
+    def submit(self, path: str, name: str, url: str, type: str):
+        """
+            提交一个下载任务, 参数和 download_asset 一致
+        """
+        self.pending.acquire()
+        with self.lock:
+            self.total += 1
+        future = self.executor.submit(bind(self._run), download_asset, path, name, url, type)
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def wait(self):
+        """
+            等待已提交的任务全部完成, 返回进度统计
+        """
+        while True:
+            with self.lock:
+                futures = list(self.futures)
+            if not futures:
+                break
+            wait(futures)
+        return self.progress()
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+        self.sessions.close()
@@ -0,0 +1,156 @@
+import json
+import os
+import queue
+import subprocess
+import threading
+from collections import deque
+from loguru import logger
+
+static_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../static'))
+worker_script = os.path.join(static_path, 'xhs_js_worker.js')
+
+
+class JS_Error(Exception):
+    pass
+
+
+class JS_Worker():
+    """
+        一个常驻的 node 进程, 脚本只在启动时加载一次
+        请求通过 stdin/stdout 按行传递 JSON, 同一时刻只处理一个请求
+    """
+    def __init__(self, script_path: str, timeout: float = 30):
+        self.script_path = script_path
+        self.timeout = timeout
+        self.process = None
+        self.lines = None
+        self.stderr_tail = deque(maxlen=20)
+        self.req_id = 0
+
+    def start(self):
+        self.process = subprocess.Popen(
+            ['node', worker_script, self.script_path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=os.path.dirname(static_path),
+            encoding='utf-8',
+            bufsize=1,
+        )
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read_stdout, args=(self.process, self.lines), daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(self.process, self.stderr_tail), daemon=True).start()
+        # 脚本加载完成后 worker 会先回一条 ready
+        self._receive(0)
+        logger.info(f'js worker 启动 pid: {self.process.pid} script: {os.path.basename(self.script_path)}')
+
+    @staticmethod
+    def _read_stdout(process, lines):
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    @staticmethod
+    def _read_stderr(process, stderr_tail):
+        # 必须持续读取 stderr, 否则管道写满后 node 进程会阻塞; 只保留最后几行用于报错
+        for line in process.stderr:
+            stderr_tail.append(line.rstrip())
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _receive(self, req_id):
+        while True:
+            try:
+                line = self.lines.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f'js worker {self.process.pid} 超时 {self.timeout}s 未响应')
+            if line is None:
+                stderr = '\n'.join(self.stderr_tail)
+                raise BrokenPipeError(f'js worker {self.process.pid} 已退出, code: {self.process.poll()}, stderr: {stderr}')
+            res = json.loads(line)
+            if res['id'] != req_id:
+                continue
+            if 'error' in res:
+                raise JS_Error(res['error'])
+            return res['result']
+
+    def call(self, fn: str, *args):
+        if not self.is_alive():
+            self.start()
+        self.req_id += 1
+        self.process.stdin.write(json.dumps({'id': self.req_id, 'fn': fn, 'args': args}, ensure_ascii=False) + '\n')
+        self.process.stdin.flush()
+        return self._receive(self.req_id)
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=3)
+        except Exception:
+            self.process.kill()
+        self.process = None
+
+
+class JS_Worker_Pool():
+    """
+        多个常驻 node 进程组成的池, 线程安全
+        :param script_path: 要加载的 js 文件
+        :param workers: 进程数量, 签名是 cpu 密集的, 按核数设置即可; 不指定时读取环境变量 XHS_SIGN_WORKERS, 默认 1
+        :param timeout: 单次调用的超时时间
+    """
+    def __init__(self, script_path: str, workers: int = None, timeout: float = 30):
+        self.script_path = script_path
+        self.workers = workers
+        self.timeout = timeout
+        self.idle = queue.Queue()
+        self.all_workers = []
+        self.lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self.all_workers:
+            return
+        with self.lock:
+            if self.all_workers:
+                return
+            if self.workers is None:
+                self.workers = int(os.getenv('XHS_SIGN_WORKERS', 1))
+            for _ in range(max(1, self.workers)):
+                worker = JS_Worker(self.script_path, self.timeout)
+                self.all_workers.append(worker)
+                self.idle.put(worker)
+
+    def call(self, fn: str, *args):
+        self._ensure_started()
+        worker = self.idle.get()
+        try:
+            try:
+                return worker.call(fn, *args)
+            except (BrokenPipeError, OSError, TimeoutError) as e:
+                # 进程崩溃或卡死, 重启后重试一次
+                logger.warning(f'js worker 异常, 重启: {e}')
+                worker.close()
+                return worker.call(fn, *args)
+        finally:
+            self.idle.put(worker)
+
+    def _close_workers(self):
+        # 调用方需要持有 self.lock
+        for worker in self.all_workers:
+            worker.close()
+        self.all_workers = []
+        self.idle = queue.Queue()
+
+    def resize(self, workers: int):
+        """
+            修改进程数量, 已启动的进程会被关闭, 下次调用时按新的数量启动
+        """
+        with self.lock:
+            self._close_workers()
+            self.workers = int(workers)
+
+    def close(self):
+        with self.lock:
+            self._close_workers()
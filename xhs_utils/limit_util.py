@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import deque
+from loguru import logger
+
+# 各类接口的默认速率 (每秒请求数): 初始速率, 最低速率, 最高速率, None 为不限制
+# 默认不限速, 第一次被限流时按当时实际的请求速率减半开始限速, 之后按 AIMD 调整
+DEFAULT_LIMITS = {
+    'feed': (None, 0.2, None),
+    'search': (None, 0.1, None),
+    'comment': (None, 0.5, None),
+    'user': (None, 0.2, None),
+    'other': (None, 0.2, None),
+}
+# 被限流时的 http 状态码和接口返回的 code
+THROTTLE_STATUS = (429, 461)
+THROTTLE_CODES = (300013,)
+
+
+def get_family(api: str):
+    """
+        按接口路径区分接口类别, 同一类接口共用一个限速器
+    """
+    path = api.split('?')[0]
+    if '/search/' in path:
+        return 'search'
+    if '/comment/' in path:
+        return 'comment'
+    if path.endswith('/feed') or '/homefeed' in path:
+        return 'feed'
+    if '/user' in path or '/note/like' in path or '/note/collect' in path:
+        return 'user'
+    return 'other'
+
+
+def is_throttled(status: int, res_json=None):
+    """
+        判断是否被限流: http 429/461 或者接口返回 code 300013 (访问频次异常)
+    """
+    if status in THROTTLE_STATUS:
+        return True
+    return isinstance(res_json, dict) and res_json.get('code') in THROTTLE_CODES
+
+
+class Token_Bucket():
+    """
+        令牌桶, 速率按 AIMD 调整: 每次成功加 increase, 被限流时乘以 decrease
+        rate 为 None 时不限速, 只统计最近 window 秒的请求速率, 第一次被限流时从这个速率开始降速
+        :param rate: 初始速率, 每秒请求数, None 为不限速
+        :param min_rate: 最低速率
+        :param max_rate: 最高速率, None 为不设上限
+        :param burst: 桶的容量, 空闲后最多连续发出的请求数, 默认为速率 (至少 1)
+        :param increase: 每次成功增加的速率
+        :param decrease: 被限流时速率乘以的系数
+        :param cooldown: 两次降速之间至少间隔的秒数, 避免同一批并发请求连续降速多次
+        :param window: 不限速时统计请求速率的秒数
+    """
+    def __init__(self, rate: float, min_rate: float, max_rate: float = None, burst: float = None, increase: float = 0.05, decrease: float = 0.5, cooldown: float = 1,
+                 window: float = 2):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.fixed_burst = burst
+        self.burst = burst if burst is not None else max(1, rate or 1)
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.window = window
+        self.recent = deque()
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.last_decrease = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+            取一个令牌, 返回需要等待的秒数, 令牌不够时预支, 后面的请求排在后面等待
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.rate is None:
+                self.recent.append(now)
+                while self.recent[0] < now - self.window:
+                    self.recent.popleft()
+                return 0
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_success(self):
+        with self.lock:
+            if self.rate is None:
+                return
+            self.rate = self.rate + self.increase
+            if self.max_rate is not None:
+                self.rate = min(self.max_rate, self.rate)
+
+    def on_throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_decrease < self.cooldown:
+                return self.rate
+            self.last_decrease = now
+            if self.rate is None:
+                # 从不限速切换为限速, 以被限流前实际的请求速率为基准
+                observed = len([t for t in self.recent if t >= now - self.window]) / self.window
+                self.recent.clear()
+                self.rate = max(self.min_rate, observed * self.decrease)
+                self.last = now
+            else:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+            if self.fixed_burst is None:
+                self.burst = max(1, self.rate)
+            # 清空桶里剩余的令牌, 降速立即生效
+            self.tokens = min(self.tokens, 0)
+            return self.rate
+
+
+class Rate_Limiter():
+    """
+        按接口类别 (feed / search / comment / user / other) 分别限速, 多个线程共用
+        :param limits: 覆盖默认速率, 如 {'search': (0.5, 0.1, 1)} 从一开始就限制 search 在 0.5 ~ 1 次每秒
+    """
+    def __init__(self, limits: dict = None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self.buckets = {family: Token_Bucket(*limit) for family, limit in self.limits.items()}
+
+    def get_bucket(self, api: str):
+        return self.buckets.get(get_family(api), self.buckets['other'])
+
+    def reserve(self, api: str):
+        return self.get_bucket(api).reserve()
+
+    def acquire(self, api: str):
+        return self.get_bucket(api).acquire()
+
+    def feedback(self, api: str, throttled: bool):
+        """
+            根据响应调整速率, 返回是否被限流
+        """
+        bucket = self.get_bucket(api)
+        if throttled:
+            rate = bucket.on_throttle()
+            logger.warning(f'接口 {get_family(api)} 被限流, 速率降为 {rate:.2f}/s')
+        else:
+            bucket.on_success()
+        return throttled
+
+    def rates(self):
+        return {family: bucket.rate for family, bucket in self.buckets.items()}
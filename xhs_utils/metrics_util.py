@@ -0,0 +1,248 @@
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 响应时间直方图的分桶 (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 内置指标的说明, 导出 prometheus 格式时作为 # HELP
+DESCRIPTIONS = {
+    'xhs_sign_seconds': 'js 签名耗时',
+    'xhs_sign_in_flight': '正在签名的请求数',
+    'xhs_api_request_seconds': '接口请求耗时 (不含签名)',
+    'xhs_api_requests_total': '接口请求数, 按 http 状态码或异常类型区分',
+    'xhs_api_errors_total': '接口返回失败的次数, 按接口返回的 code 区分',
+    'xhs_api_in_flight': '正在进行的接口请求数',
+    'xhs_media_download_seconds': '单个媒体文件的下载耗时',
+    'xhs_media_bytes_total': '下载的媒体文件字节数',
+    'xhs_media_downloads_total': '媒体文件下载次数, 按结果区分',
+    'xhs_media_in_flight': '正在下载的媒体文件数',
+}
+
+
+class _Histogram():
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for le, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            yield le, total
+
+
+class _Timer():
+    """
+        记录 with 块的耗时到直方图, 块内计入正在进行的数量
+    """
+    def __init__(self, registry, name, gauge, labels):
+        self.registry = registry
+        self.name = name
+        self.gauge = gauge
+        self.labels = labels
+
+    def __enter__(self):
+        if self.gauge is not None:
+            self.registry.add(self.gauge, 1, **self.labels)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if self.gauge is not None:
+            self.registry.add(self.gauge, -1, **self.labels)
+
+
+class _Null_Timer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+
+_NULL_TIMER = _Null_Timer()
+
+
+class Metrics():
+    """
+        进程内的指标: counter / gauge / histogram, 每个指标按标签区分
+        默认关闭, 关闭时所有方法直接返回; 设置环境变量 XHS_METRICS=1 或者调用 enable() 打开
+        导出为 prometheus 文本格式 (to_prometheus / serve) 或者 json (snapshot / dump)
+        :param buckets: 直方图的分桶
+    """
+    def __init__(self, enabled: bool = False, buckets: tuple = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.types = {}
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.types = {}
+            self.values = {}
+
+    def _series(self, kind, name, labels):
+        # 调用方需要持有 self.lock
+        if self.types.setdefault(name, kind) != kind:
+            raise ValueError(f'指标 {name} 已经是 {self.types[name]}')
+        return self.values.setdefault(name, {}), tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+            counter 加 value
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            series, key = self._series('counter', name, labels)
+            series[key] = series.get(key, 0) + value
+
+    def add(self, name: str, value: float, **labels):
+        """
+            gauge 加 value, 可以是负数
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            series, key = self._series('gauge', name, labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            series, key = self._series('gauge', name, labels)
+            series[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+            直方图记录一个值
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            series, key = self._series('histogram', name, labels)
+            if key not in series:
+                series[key] = _Histogram(self.buckets)
+            series[key].observe(value)
+
+    def timer(self, name: str, gauge: str = None, **labels):
+        """
+            with metrics.timer('xhs_sign_seconds', gauge='xhs_sign_in_flight'): ...
+            记录耗时到直方图 name, 传入 gauge 时同时记录正在进行的数量
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, gauge, labels)
+
+    def snapshot(self):
+        """
+            所有指标的 json 快照: {name: {'type': ..., 'series': [{'labels': {...}, 'value': ...}]}}
+            直方图的 value 为 count, sum 和各分桶的累计数量
+        """
+        with self.lock:
+            result = {}
+            for name, series in self.values.items():
+                kind = self.types[name]
+                items = []
+                for key, value in series.items():
+                    if kind == 'histogram':
+                        value = {'count': value.count, 'sum': value.sum, 'buckets': {str(le): count for le, count in value.cumulative()}}
+                    items.append({'labels': dict(key), 'value': value})
+                result[name] = {'type': kind, 'series': items}
+        return result
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in items) + '}'
+
+    def to_prometheus(self):
+        """
+            prometheus 文本格式
+        """
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.values.items()):
+                kind = self.types[name]
+                if name in DESCRIPTIONS:
+                    lines.append(f'# HELP {name} {DESCRIPTIONS[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key, value in sorted(series.items()):
+                    if kind == 'histogram':
+                        for le, count in value.cumulative():
+                            lines.append(f'{name}_bucket{self._format_labels(key, [("le", str(le))])} {count}')
+                        lines.append(f'{name}_sum{self._format_labels(key)} {value.sum}')
+                        lines.append(f'{name}_count{self._format_labels(key)} {value.count}')
+                    else:
+                        lines.append(f'{name}{self._format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, file_path: str):
+        """
+            写入文件, .prom 或 .txt 结尾时为 prometheus 格式, 否则为 json
+        """
+        if file_path.endswith(('.prom', '.txt')):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        with open(file_path, mode='w', encoding='utf-8') as f:
+            f.write(content)
+
+    def serve(self, port: int = 9108, host: str = '127.0.0.1'):
+        """
+            在后台线程启动 http 服务, /metrics 返回 prometheus 格式, /metrics.json 返回 json, 返回 server, 用 server.shutdown() 停止
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics.json':
+                    body, content_type = json.dumps(registry.snapshot(), ensure_ascii=False).encode('utf-8'), 'application/json'
+                elif self.path == '/metrics':
+                    body, content_type = registry.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics_server', daemon=True).start()
+        return server
+
+
+def get_endpoint(api: str):
+    """
+        指标里的接口名, 去掉 query 参数
+    """
+    return api.split('?')[0]
+
+
+metrics = Metrics(enabled=os.environ.get('XHS_METRICS', '') not in ('', '0'))
@@ -0,0 +1,142 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from xhs_utils.timeout_util import bind
+
+
+def parse_cursor_page(key: str, cut=None):
+    """
+        按 cursor 翻页的接口, 返回 parse(res_json, cursor) -> 本页的数据, 下一页的 cursor (None 表示没有下一页)
+        :param key: 数据在 res_json['data'] 中的字段
+        :param cut: cut(items) 返回 保留的部分, 是否停止翻页, 用于增量同步
+    """
+    def parse(res_json, cursor):
+        data = res_json["data"]
+        if 'cursor' not in data:
+            return [], None
+        items = data[key]
+        next_cursor = str(data["cursor"]) if len(items) > 0 and data["has_more"] else None
+        if cut is not None:
+            items, reached = cut(items)
+            if reached:
+                next_cursor = None
+        return items, next_cursor
+    return parse
+
+
+def parse_number_page(key: str):
+    """
+        按页码翻页的接口 (搜索), 页码从 1 开始
+    """
+    def parse(res_json, page):
+        data = res_json["data"]
+        if key not in data:
+            return [], None
+        return data[key], page + 1 if data["has_more"] else None
+    return parse
+
+
+class Page_Iterator():
+    """
+        懒加载的翻页迭代器, 逐条产出数据, 调用方处理当前页时后台线程预取下一页
+        调用方提前停止时最多多请求一页, 指定 limit 时拿够数量就不再预取
+        出错时停止迭代, 结果记录在 success 和 msg 中
+        :param fetch: fetch(state) 返回 success, msg, res_json
+        :param parse: parse(res_json, state) 返回 本页的数据, 下一页的 state (None 表示没有下一页)
+        :param state: 第一页的 state, 如 cursor 或页码
+        :param limit: 最多产出的数量
+        :param prefetch: 是否预取下一页
+    """
+    def __init__(self, fetch, parse, state, limit: int = None, prefetch: bool = True):
+        self.fetch = fetch
+        self.parse = parse
+        self.state = state
+        self.limit = limit
+        self.prefetch = prefetch
+        self.success = True
+        self.msg = 'success'
+        self.count = 0
+
+    def _parse(self, state, res):
+        success, msg, res_json = res
+        if not success:
+            raise Exception(msg)
+        return self.parse(res_json, state)
+
+    def _fail(self, e):
+        self.success = False
+        self.msg = str(e)
+
+    def _next_state(self, items, next_state):
+        """
+            截断超出 limit 的部分, 返回 本页产出的数据, 是否还需要下一页
+        """
+        if self.limit is not None:
+            items = items[:max(self.limit - self.count, 0)]
+            if self.count + len(items) >= self.limit:
+                return items, False
+        return items, next_state is not None
+
+    def _get_page(self, state):
+        return self._parse(state, self.fetch(state))
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='page_prefetch') if self.prefetch else None
+        future = None
+        try:
+            items, next_state = self._get_page(self.state)
+            while True:
+                items, has_next = self._next_state(items, next_state)
+                if has_next and executor is not None:
+                    future = executor.submit(bind(self._get_page), next_state)
+                for item in items:
+                    self.count += 1
+                    yield item
+                if not has_next:
+                    break
+                if future is not None:
+                    items, next_state = future.result()
+                    future = None
+                else:
+                    items, next_state = self._get_page(next_state)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            if future is not None:
+                future.cancel()
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+
+class Async_Page_Iterator(Page_Iterator):
+    """
+        Page_Iterator 的 asyncio 版本, fetch 返回协程, 用 async for 迭代, 预取用 task 完成
+    """
+    async def _get_page(self, state):
+        return self._parse(state, await self.fetch(state))
+
+    def __iter__(self):
+        raise TypeError('Async_Page_Iterator 需要使用 async for')
+
+    async def __aiter__(self):
+        task = None
+        try:
+            items, next_state = await self._get_page(self.state)
+            while True:
+                items, has_next = self._next_state(items, next_state)
+                if has_next and self.prefetch:
+                    task = asyncio.ensure_future(self._get_page(next_state))
+                for item in items:
+                    self.count += 1
+                    yield item
+                if not has_next:
+                    break
+                if task is not None:
+                    items, next_state = await task
+                    task = None
+                else:
+                    items, next_state = await self._get_page(next_state)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            if task is not None:
+                task.cancel()
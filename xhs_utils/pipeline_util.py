@@ -0,0 +1,106 @@
+import queue
+import threading
+from loguru import logger
+from xhs_utils.timeout_util import bind
+
+_STOP = object()
+_DROP = object()
+
+
+class Pipeline():
+    """
+        分阶段的流水线, 阶段之间用有界队列连接, 各阶段同时运行
+        下游处理不过来时队列写满, 上游阻塞等待 (背压), 不会无限制地堆积数据
+        同时在流水线里的数据不超过 queue_size 条, 按顺序输出时某一项卡住也不会把后面的输入全部读进来
+        阶段函数返回 None 表示丢弃这一项, 抛出异常时记录日志后丢弃
+        :param queue_size: 每个队列的容量, 也是同时在流水线里 (包括等待按顺序输出) 的数据上限
+    """
+    def __init__(self, queue_size: int = 32):
+        self.queue_size = queue_size
+        self.stages = []
+
+    def add_stage(self, name: str, fn, workers: int = 1):
+        self.stages.append((name, fn, max(1, workers)))
+        return self
+
+    @staticmethod
+    def _work(name, fn, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is _STOP:
+                # 放回去让同一阶段的其他线程也能退出
+                in_queue.put(_STOP)
+                break
+            index, value = item
+            if value is not _DROP:
+                try:
+                    value = fn(value)
+                except Exception as e:
+                    logger.error(f'流水线阶段 {name} 出错: {e}')
+                    value = None
+                if value is None:
+                    value = _DROP
+            out_queue.put((index, value))
+
+    @staticmethod
+    def _close(threads, out_queue):
+        for thread in threads:
+            thread.join()
+        out_queue.put(_STOP)
+
+    @staticmethod
+    def _feed(items, out_queue, window):
+        try:
+            for index, item in enumerate(items):
+                # sink 取走一项后才放入新的一项
+                window.acquire()
+                out_queue.put((index, item))
+        except Exception as e:
+            logger.error(f'流水线输入出错: {e}')
+        finally:
+            out_queue.put(_STOP)
+
+    def run(self, items, sink=None, ordered: bool = True):
+        """
+            运行流水线, sink 在调用线程里依次接收最后一个阶段的输出
+            :param items: 输入, 可以是生成器
+            :param ordered: 是否按输入顺序交给 sink
+            返回交给 sink 的数量
+        """
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        window = threading.BoundedSemaphore(self.queue_size)
+        # 阶段函数在其他线程里运行, 用 bind 带上调用方的截止时间
+        threading.Thread(target=bind(self._feed), args=(items, queues[0], window), daemon=True).start()
+        for stage_index, (name, fn, workers) in enumerate(self.stages):
+            threads = []
+            for _ in range(workers):
+                thread = threading.Thread(target=bind(self._work), args=(name, fn, queues[stage_index], queues[stage_index + 1]),
+                                          name=f'pipeline_{name}', daemon=True)
+                thread.start()
+                threads.append(thread)
+            threading.Thread(target=self._close, args=(threads, queues[stage_index + 1]), daemon=True).start()
+
+        count = 0
+        next_index = 0
+        pending = {}
+        while True:
+            item = queues[-1].get()
+            if item is _STOP:
+                break
+            if ordered:
+                # 乱序到达的先暂存, 等前面的都到了再按顺序输出
+                pending[item[0]] = item[1]
+                ready = []
+                while next_index in pending:
+                    ready.append(pending.pop(next_index))
+                    next_index += 1
+            else:
+                ready = [item[1]]
+            for value in ready:
+                window.release()
+                if value is _DROP:
+                    continue
+                if sink is not None:
+                    sink(value)
+                count += 1
+        return count
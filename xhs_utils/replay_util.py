@@ -0,0 +1,238 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+
+# 每次请求都会变化的参数, 匹配录制的响应时忽略
+IGNORED_FIELDS = ('search_id',)
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def request_key(method: str, url: str, body=None):
+    """
+        录制和回放时匹配请求用的 key: 方法 + 路径和参数 + 规范化的请求体, 不包含 host 和请求头 (签名, cookies)
+    """
+    parsed = urllib.parse.urlsplit(url)
+    path = parsed.path + ('?' + parsed.query if parsed.query else '')
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+    if body:
+        try:
+            data = json.loads(body)
+            if isinstance(data, dict):
+                data = {k: v for k, v in data.items() if k not in IGNORED_FIELDS}
+            body = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        except ValueError:
+            pass
+    return f'{method.upper()} {path} {body or ""}'.rstrip()
+
+
+class Recorder():
+    """
+        录制请求和响应, 用于离线回放, 通过 requests 的 response hook 挂在 session 上
+        XHS_Apis(recorder=...) 录制 edith 接口, Media_Downloader(recorder=...) 录制 CDN 的图片和视频
+        目录结构: index.jsonl 每行一个请求, 响应内容按 sha1 保存在 bodies/ 下, 相同的内容只存一份
+        带 Range 的请求不录制, 回放服务器会从完整的文件里按 Range 返回; 所以 Media_Downloader 录制时强制 video_segments=1,
+        断点续传 (media 目录里有上次留下的 .part) 的视频也录不到, 录制时使用空的 media 目录
+        录制时响应会整体读进内存, 只在录制 fixture 时打开
+        :param dir_path: 保存的目录
+    """
+    def __init__(self, dir_path: str):
+        self.dir_path = dir_path
+        os.makedirs(os.path.join(dir_path, 'bodies'), exist_ok=True)
+        self.file = open(os.path.join(dir_path, 'index.jsonl'), mode='a', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def hook(self, response, *args, **kwargs):
+        """
+            session.hooks['response'] 的回调
+        """
+        request = response.request
+        if 'Range' in request.headers:
+            return response
+        try:
+            self.record(request.method, request.url, request.body, response.status_code, response.headers.get('Content-Type', ''), response.content)
+        except Exception as e:
+            logger.warning(f'录制失败 {request.url}: {e}')
+        return response
+
+    def record(self, method: str, url: str, body, status: int, content_type: str, content: bytes):
+        digest = hashlib.sha1(content).hexdigest()
+        body_path = os.path.join(self.dir_path, 'bodies', digest)
+        item = {
+            'key': request_key(method, url, body),
+            'url': url,
+            'status': status,
+            'content_type': content_type,
+            'body': digest,
+            'size': len(content),
+        }
+        with self.lock:
+            if not os.path.exists(body_path):
+                with open(body_path, mode='wb') as f:
+                    f.write(content)
+            self.file.write(json.dumps(item, ensure_ascii=False) + '\n')
+            self.file.flush()
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def load_records(dir_path: str):
+    """
+        读取录制的请求, 同一个 key 录制了多次时使用最后一次
+    """
+    records = {}
+    with open(os.path.join(dir_path, 'index.jsonl'), encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                records[item['key']] = item
+    return records
+
+
+class Replay_Server():
+    """
+        回放录制的请求的本地 http 服务器, 不校验签名和 cookies, 按 request_key 匹配录制的响应
+        edith 接口和 CDN 共用一个地址, 使用时把 XHS_Apis 的 base_url 和 Media_Downloader 的 cdn_url 都指向它
+        媒体文件支持 Range, 可以测试断点续传和分段下载
+        :param dir_path: Recorder 录制的目录
+        :param latency: 返回响应头之前等待的秒数, 可以是 (最小, 最大) 随机取值
+        :param bandwidth: 每个连接每秒发送的字节数, None 为不限制
+        :param host: 监听的地址
+        :param port: 监听的端口, 0 为随机端口
+    """
+    def __init__(self, dir_path: str, latency=0, bandwidth: float = None, host: str = '127.0.0.1', port: int = 0):
+        self.dir_path = dir_path
+        self.records = load_records(dir_path)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stats = {'hits': 0, 'misses': 0}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _delay(self):
+        if isinstance(self.latency, (tuple, list)):
+            return random.uniform(*self.latency)
+        return self.latency
+
+    def _make_handler(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else None
+                record = replay.records.get(request_key(self.command, self.path, body))
+                with replay.lock:
+                    replay.stats['hits' if record is not None else 'misses'] += 1
+                delay = replay._delay()
+                if delay:
+                    time.sleep(delay)
+                if record is None:
+                    logger.warning(f'没有录制的请求: {self.command} {self.path}')
+                    self._send(404, 'application/json', json.dumps({'success': False, 'msg': '没有录制的请求', 'code': -404}).encode('utf-8'))
+                    return
+                with open(os.path.join(replay.dir_path, 'bodies', record['body']), mode='rb') as f:
+                    content = f.read()
+                status = record['status']
+                headers = {}
+                if status == 200:
+                    headers['Accept-Ranges'] = 'bytes'
+                    match = RANGE_RE.match(self.headers.get('Range', ''))
+                    if match and (match.group(1) or match.group(2)):
+                        total = len(content)
+                        if match.group(1):
+                            start, end = int(match.group(1)), int(match.group(2)) if match.group(2) else total - 1
+                        else:
+                            start, end = max(total - int(match.group(2)), 0), total - 1
+                        end = min(end, total - 1)
+                        if start >= total or start > end:
+                            self._send(416, record['content_type'], b'', {'Content-Range': f'bytes */{total}'})
+                            return
+                        status, content = 206, content[start:end + 1]
+                        headers['Content-Range'] = f'bytes {start}-{end}/{total}'
+                self._send(status, record['content_type'], content, headers)
+
+            def _send(self, status, content_type, content, headers=None):
+                self.send_response(status)
+                if content_type:
+                    self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(content)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if self.command == 'HEAD':
+                    return
+                if not replay.bandwidth:
+                    self.wfile.write(content)
+                    return
+                chunk_size = max(1024, int(replay.bandwidth / 20))
+                for start in range(0, len(content), chunk_size):
+                    chunk = content[start:start + chunk_size]
+                    self.wfile.write(chunk)
+                    time.sleep(len(chunk) / replay.bandwidth)
+
+            do_GET = do_POST = do_HEAD = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """
+            在后台线程启动, 返回 base_url
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, name='replay_server', daemon=True)
+        self.thread.start()
+        logger.info(f'回放服务器 {self.base_url}, 录制的请求 {len(self.records)} 条')
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+if __name__ == '__main__':
+    """
+        python -m xhs_utils.replay_util datas/fixtures --port 8000 --latency 0.05 --bandwidth 2000000
+        然后 XHS_BASE_URL=http://127.0.0.1:8000 XHS_CDN_URL=http://127.0.0.1:8000 python main.py
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dir_path', help='Recorder 录制的目录')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, nargs='+', default=[0], help='响应延迟秒数, 传两个值时在范围内随机')
+    parser.add_argument('--bandwidth', type=float, default=None, help='每个连接每秒发送的字节数')
+    args = parser.parse_args()
+    latency = tuple(args.latency) if len(args.latency) > 1 else args.latency[0]
+    replay_server = Replay_Server(args.dir_path, latency, args.bandwidth, args.host, args.port)
+    replay_server.server.serve_forever()
@@ -0,0 +1,62 @@
+import threading
+import urllib.parse
+from http.cookiejar import DefaultCookiePolicy
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def create_session(pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 0.5, hooks: list = None):
+    """
+        创建带连接池和重试的 session, 连接会被复用 (keep-alive)
+        :param pool_size: 每个 host 保持的最大连接数, 并发请求数超过它时多出来的连接用完即关
+        :param max_retries: 连接失败和 5xx 时的重试次数, 读取超时不重试, 避免一次卡住的请求重复等待超过截止时间
+        :param backoff_factor: 重试间隔的退避系数
+        :param hooks: 响应的回调, 如 Recorder.hook
+    """
+    session = requests.Session()
+    session.hooks['response'].extend(hooks or [])
+    # cookies 每次请求单独传入, 不让响应里的 set-cookie 留在 session 里串到别的账号
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    retry = Retry(
+        total=max_retries,
+        read=0,
+        backoff_factor=backoff_factor,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class Session_Pool():
+    """
+        按 host 维护的 session, 每个 host 一个连接池
+    """
+    def __init__(self, pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 0.5, hooks: list = None):
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.hooks = hooks
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, url: str):
+        host = urllib.parse.urlparse(url).netloc
+        session = self.sessions.get(host)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(host)
+                if session is None:
+                    session = create_session(self.pool_size, self.max_retries, self.backoff_factor, self.hooks)
+                    self.sessions[host] = session
+        return session
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
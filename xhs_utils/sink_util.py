@@ -0,0 +1,240 @@
+import csv
+import json
+import os
+import re
+from loguru import logger
+from xhs_utils.data_util import Xlsx_Writer
+
+# handle_note_info / handle_user_info / handle_comment_info 返回的字段
+FIELDS = {
+    'note': ['note_id', 'note_url', 'note_type', 'user_id', 'home_url', 'nickname', 'avatar', 'title', 'desc', 'liked_count', 'collected_count', 'comment_count', 'share_count', 'video_cover', 'video_addr', 'image_list', 'tags', 'upload_time', 'ip_location'],
+    'user': ['user_id', 'home_url', 'nickname', 'avatar', 'red_id', 'gender', 'ip_location', 'desc', 'follows', 'fans', 'interaction', 'tags'],
+    'comment': ['note_id', 'note_url', 'comment_id', 'parent_comment_id', 'user_id', 'home_url', 'nickname', 'avatar', 'content', 'show_tags', 'like_count', 'upload_time', 'ip_location', 'pictures'],
+}
+# 互动数量, 接口返回的是 "1.2万" "10+" 这样的字符串, 导出时转成整数
+COUNT_FIELDS = {
+    'note': ['liked_count', 'collected_count', 'comment_count', 'share_count'],
+    'user': ['follows', 'fans', 'interaction'],
+    'comment': ['like_count'],
+}
+LIST_FIELDS = {
+    'note': ['image_list', 'tags'],
+    'user': ['tags'],
+    'comment': ['show_tags', 'pictures'],
+}
+SINK_EXTENSIONS = {
+    'excel': '.xlsx',
+    'jsonl': '.jsonl',
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'sqlite': '.db',
+}
+# sqlite 所有任务写入同一个库, 不按 excel_name 分文件, 方便去重和查询
+SQLITE_DB_NAME = 'xhs_data'
+COUNT_RE = re.compile(r'^([\d.]+)\s*(万|w|亿)?\+?$')
+
+
+def parse_count(value):
+    """
+        "1.2万" -> 12000, "10+" -> 10, "356" -> 356, 无法解析时返回 None
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = COUNT_RE.match(str(value).strip().replace(',', ''))
+    if not match:
+        return None
+    number = float(match.group(1))
+    if match.group(2) in ('万', 'w'):
+        number *= 10000
+    elif match.group(2) == '亿':
+        number *= 100000000
+    return int(number)
+
+
+def trans_row(data: dict, type: str):
+    """
+        按 FIELDS 的顺序整理一行, 互动数量转成整数
+    """
+    row = {field: data.get(field) for field in FIELDS[type]}
+    for field in COUNT_FIELDS[type]:
+        row[field] = parse_count(row[field])
+    return row
+
+
+class Jsonl_Sink():
+    """
+        jsonl, 一行一条记录, 已有的文件会被覆盖
+    """
+    def __init__(self, file_path: str, type: str = 'note'):
+        self.file_path = file_path
+        self.type = type
+        self.count = 0
+        self.f = open(file_path, mode='w', encoding='utf-8')
+
+    def write(self, data: dict):
+        self.f.write(json.dumps(trans_row(data, self.type), ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+            logger.info(f'数据保存至 {self.file_path}')
+        return [self.file_path]
+
+
+class Csv_Sink():
+    """
+        csv, 列表字段以 json 字符串保存, 已有的文件会被覆盖
+    """
+    def __init__(self, file_path: str, type: str = 'note'):
+        self.file_path = file_path
+        self.type = type
+        self.count = 0
+        # utf-8-sig 让 excel 能正确识别中文
+        self.f = open(file_path, mode='w', encoding='utf-8-sig', newline='')
+        self.writer = csv.DictWriter(self.f, fieldnames=FIELDS[type])
+        self.writer.writeheader()
+
+    def write(self, data: dict):
+        row = trans_row(data, self.type)
+        for field in LIST_FIELDS[self.type]:
+            row[field] = json.dumps(row[field], ensure_ascii=False)
+        self.writer.writerow(row)
+        self.count += 1
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+            logger.info(f'数据保存至 {self.file_path}')
+        return [self.file_path]
+
+
+class Parquet_Sink():
+    """
+        parquet 列式存储, 每 batch_size 行写一个 row group, 需要安装 pyarrow, 已有的文件会被覆盖
+        互动数量为 int64 列, 列表字段为 list<string> 列
+    """
+    def __init__(self, file_path: str, type: str = 'note', batch_size: int = 10000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('导出 parquet 需要安装 pyarrow: pip install pyarrow')
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.file_path = file_path
+        self.type = type
+        self.batch_size = batch_size
+        self.count = 0
+        self.rows = []
+        fields = []
+        for field in FIELDS[type]:
+            if field in COUNT_FIELDS[type]:
+                fields.append(pyarrow.field(field, pyarrow.int64()))
+            elif field in LIST_FIELDS[type]:
+                fields.append(pyarrow.field(field, pyarrow.list_(pyarrow.string())))
+            else:
+                fields.append(pyarrow.field(field, pyarrow.string()))
+        self.schema = pyarrow.schema(fields)
+        self.writer = self.pq.ParquetWriter(file_path, self.schema)
+
+    def _flush(self):
+        if not self.rows:
+            return
+        columns = {}
+        for field in self.schema.names:
+            values = [row[field] for row in self.rows]
+            if field not in COUNT_FIELDS[self.type] and field not in LIST_FIELDS[self.type]:
+                values = [None if value is None else str(value) for value in values]
+            elif field in LIST_FIELDS[self.type]:
+                values = [None if value is None else [str(v) for v in value] for value in values]
+            columns[field] = values
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+        self.rows = []
+
+    def write(self, data: dict):
+        self.rows.append(trans_row(data, self.type))
+        self.count += 1
+        if len(self.rows) >= self.batch_size:
+            self._flush()
+
+    def close(self):
+        if self.writer is not None:
+            self._flush()
+            self.writer.close()
+            self.writer = None
+            logger.info(f'数据保存至 {self.file_path}')
+        return [self.file_path]
+
+
+def get_sink_choices(save_choice: str):
+    """
+        save_choice 中选择的导出格式, 可以用 + 组合, 如 media+parquet, all 包含 excel
+    """
+    parts = save_choice.split('+')
+    sinks = [part for part in parts if part in SINK_EXTENSIONS]
+    if 'all' in parts and 'excel' not in sinks:
+        sinks.insert(0, 'excel')
+    return sinks
+
+
+def need_file_name(sink_choices: list):
+    """
+        除了 sqlite 之外的导出格式都需要 excel_name 作为文件名
+    """
+    return any(kind != 'sqlite' for kind in sink_choices)
+
+
+def get_media_choice(save_choice: str):
+    """
+        save_choice 中的媒体下载选项, 返回 all / media / media-image / media-video, 没有时返回 None
+    """
+    for part in save_choice.split('+'):
+        if part == 'all' or part.startswith('media'):
+            return part
+    return None
+
+
+def open_sink(kind: str, dir_path: str, name: str, type: str = 'note'):
+    """
+        打开一个导出目标, 返回的对象都有 write(data) 和 close()
+        重复运行同名的任务时, excel / jsonl / csv / parquet 文件都会被覆盖, 只保留这一次的数据
+        sqlite 按主键 upsert, 保留之前的数据并更新重复的记录
+        :param kind: excel / jsonl / csv / parquet / sqlite
+        :param dir_path: 保存目录
+        :param name: 文件名, 不含后缀, sqlite 固定写入 SQLITE_DB_NAME
+        :param type: note / user / comment
+    """
+    if kind == 'sqlite':
+        from xhs_utils.db_util import Sqlite_Sink
+        return Sqlite_Sink(os.path.abspath(os.path.join(dir_path, f'{SQLITE_DB_NAME}.db')), type)
+    file_path = os.path.abspath(os.path.join(dir_path, f'{name}{SINK_EXTENSIONS[kind]}'))
+    if kind == 'excel':
+        return Xlsx_Writer(file_path, type)
+    elif kind == 'jsonl':
+        return Jsonl_Sink(file_path, type)
+    elif kind == 'csv':
+        return Csv_Sink(file_path, type)
+    elif kind == 'parquet':
+        return Parquet_Sink(file_path, type)
+    raise ValueError(f'不支持的导出格式 {kind}')
+
+
+class Multi_Sink():
+    """
+        同时写入多个导出目标
+    """
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+
+    def write(self, data: dict):
+        for sink in self.sinks:
+            sink.write(data)
+
+    def close(self):
+        files = []
+        for sink in self.sinks:
+            files.extend(sink.close())
+        return files
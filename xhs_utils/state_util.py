@@ -0,0 +1,114 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from loguru import logger
+from xhs_utils.data_util import media_file_path
+
+
+def get_note_id(note_url: str):
+    """
+        从笔记链接中取出 note_id
+    """
+    return urllib.parse.urlparse(note_url).path.rstrip('/').split('/')[-1]
+
+
+class Crawl_State():
+    """
+        已经爬取过的笔记记录, 保存在 sqlite 里, 第一次用到时整体读进内存的 set
+        数据库为空时扫描 media 目录下已有的 {nickname}_{user_id}/{title}_{note_id}, info.json 和全部媒体文件都在的作为初始记录
+        同时记录每个用户上次同步到的最新笔记, 用于增量同步用户的笔记
+        :param db_path: 数据库文件路径
+        :param media_path: 媒体文件的保存目录, 用于初始化
+    """
+    def __init__(self, db_path: str, media_path: str = None):
+        self.db_path = db_path
+        self.media_path = media_path
+        self.note_ids = None
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if self.note_ids is not None:
+            return
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS done_note (note_id TEXT PRIMARY KEY, crawl_time INTEGER)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS user_mark (user_id TEXT PRIMARY KEY, note_ids TEXT, sync_time INTEGER)')
+        self.note_ids = set(row[0] for row in self.conn.execute('SELECT note_id FROM done_note'))
+        if not self.note_ids and self.media_path is not None and os.path.isdir(self.media_path):
+            self._seed()
+
+    def _seed(self):
+        note_ids = set()
+        for user_dir in os.scandir(self.media_path):
+            if not user_dir.is_dir():
+                continue
+            for note_dir in os.scandir(user_dir.path):
+                if note_dir.is_dir() and self._is_complete(note_dir.path):
+                    note_ids.add(note_dir.name.rsplit('_', 1)[-1])
+        if not note_ids:
+            return
+        crawl_time = int(time.time())
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO done_note VALUES (?, ?)', [(note_id, crawl_time) for note_id in note_ids])
+        self.note_ids = note_ids
+        logger.info(f'从 {self.media_path} 导入已爬取的笔记 {len(note_ids)} 条')
+
+    @staticmethod
+    def _is_complete(note_path):
+        # info.json 在下载媒体之前写入, 还要检查笔记类型对应的媒体文件是否都已经下载
+        try:
+            with open(os.path.join(note_path, 'info.json'), encoding='utf-8') as f:
+                note_info = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if note_info.get('note_type') == '图集':
+            files = [media_file_path(note_path, f'image_{index}', 'image') for index in range(len(note_info.get('image_list') or []))]
+        elif note_info.get('note_type') == '视频':
+            files = [media_file_path(note_path, 'cover', 'image'), media_file_path(note_path, 'video', 'video')]
+        else:
+            files = []
+        return all(os.path.exists(file_path) for file_path in files)
+
+    def contains(self, note_id: str):
+        with self.lock:
+            self._load()
+            return note_id in self.note_ids
+
+    def add(self, note_id: str):
+        with self.lock:
+            self._load()
+            if note_id in self.note_ids:
+                return
+            self.note_ids.add(note_id)
+            with self.conn:
+                self.conn.execute('INSERT OR IGNORE INTO done_note VALUES (?, ?)', (note_id, int(time.time())))
+
+    def get_user_mark(self, user_id: str):
+        """
+            上次同步时该用户最新的几个笔记id, 没有同步过时返回空列表
+        """
+        with self.lock:
+            self._load()
+            row = self.conn.execute('SELECT note_ids FROM user_mark WHERE user_id = ?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def set_user_mark(self, user_id: str, note_ids: list):
+        """
+            记录该用户最新的几个笔记id, 保存多个是为了最新的笔记被删除后仍然能找到截断的位置
+        """
+        with self.lock:
+            self._load()
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO user_mark VALUES (?, ?, ?)', (user_id, json.dumps(note_ids), int(time.time())))
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+                self.note_ids = None
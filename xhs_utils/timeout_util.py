@@ -0,0 +1,100 @@
+import contextlib
+import contextvars
+import functools
+import math
+import threading
+import time
+from collections import deque
+
+# 接口请求的 (连接超时, 读取超时) 秒数
+API_TIMEOUT = (5, 20)
+# 媒体下载的 (连接超时, 读取超时), 读取超时是两次收到数据之间的间隔, 不是整个文件的下载时间
+MEDIA_TIMEOUT = (5, 30)
+
+_deadline = contextvars.ContextVar('xhs_deadline', default=None)
+
+
+class Deadline_Exceeded(TimeoutError):
+    pass
+
+
+@contextlib.contextmanager
+def deadline(seconds: float = None):
+    """
+        在 with 块内设置截止时间, 块内的所有请求 (包括交给线程池的, 需要用 bind 包装) 都不会超过这个时间
+        嵌套时取更早的截止时间, seconds 为 None 时不限制
+    """
+    if seconds is None:
+        yield
+        return
+    end = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(end if current is None else min(current, end))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+        距离截止时间的秒数, 没有设置截止时间时返回 None
+    """
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+
+def check_deadline():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise Deadline_Exceeded('超过任务的截止时间')
+
+
+def get_timeout(timeout=API_TIMEOUT):
+    """
+        requests 使用的 (连接超时, 读取超时), 不超过剩余时间
+    """
+    check_deadline()
+    left = remaining()
+    if left is None:
+        return timeout
+    return min(timeout[0], left), min(timeout[1], left)
+
+
+def bind(fn):
+    """
+        把当前的截止时间带到其他线程里, 提交给线程池的函数用它包装
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # 同一个 context 不能同时在多个线程里运行, 每次调用复制一份
+        return context.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+class Latency_Tracker():
+    """
+        记录每类接口最近的响应时间, 用于计算对冲请求的触发时间
+        :param size: 每类接口保留的样本数
+        :param min_samples: 样本数不够时不返回分位数
+    """
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.size = size
+        self.min_samples = min_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, key: str, seconds: float):
+        with self.lock:
+            if key not in self.samples:
+                self.samples[key] = deque(maxlen=self.size)
+            self.samples[key].append(seconds)
+
+    def percentile(self, key: str, percent: float):
+        with self.lock:
+            samples = sorted(self.samples.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(len(samples) * percent / 100) - 1)]
@@ -0,0 +1,208 @@
+import atexit
+import contextlib
+import contextvars
+import cProfile
+import json
+import os
+import threading
+import time
+from loguru import logger
+
+# 当前任务的统计, 线程池里用 timeout_util.bind 提交的函数和 asyncio 的 task 会带上它, 同时运行的任务互不影响
+_job_stats = contextvars.ContextVar('xhs_trace_job', default=None)
+
+
+class _Span():
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._record(self.name, self.start, time.perf_counter() - self.start, self.args)
+
+
+class _Null_Span():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+
+_NULL_SPAN = _Null_Span()
+
+
+class Tracer():
+    """
+        按阶段记录耗时 (url 解析, 限速等待, 签名, http, handle_note_info, 媒体写入, 导出), 默认关闭, 关闭时 span 直接返回
+        设置环境变量 XHS_TRACE=1 或者调用 enable() 打开, 每个 Data_Spider 任务结束时输出各阶段的耗时
+        XHS_TRACE_FILE 指定时程序退出前把所有 span 写成 chrome trace (chrome://tracing 或 perfetto 打开)
+        :param max_events: chrome trace 最多保留的 span 数量, 超过后只统计不保留
+    """
+    def __init__(self, enabled: bool = False, trace_file: str = None, max_events: int = 1000000):
+        self.enabled = False
+        self.trace_file = None
+        self.max_events = max_events
+        self.stats = {}
+        self.events = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        if enabled:
+            self.enable(trace_file)
+
+    def enable(self, trace_file: str = None):
+        """
+            :param trace_file: 程序退出前写入 chrome trace 的文件路径, 不传时只输出各阶段的耗时
+        """
+        self.enabled = True
+        if trace_file and self.trace_file is None:
+            atexit.register(self._dump_at_exit)
+        self.trace_file = trace_file or self.trace_file
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name: str, **args):
+        """
+            with tracer.span('sign'): ... 记录 with 块的耗时, args 写入 chrome trace
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    @staticmethod
+    def _add(stats, name, duration):
+        stat = stats.get(name)
+        if stat is None:
+            stat = stats[name] = [0, 0.0, 0.0]
+        stat[0] += 1
+        stat[1] += duration
+        stat[2] = max(stat[2], duration)
+
+    def _record(self, name, start, duration, args):
+        job_stats = _job_stats.get()
+        with self.lock:
+            self._add(self.stats, name, duration)
+            if job_stats is not None:
+                self._add(job_stats, name, duration)
+            if self.trace_file and len(self.events) < self.max_events:
+                thread = threading.current_thread()
+                self.events.append((name, start, duration, thread.ident, thread.name, args))
+
+    @contextlib.contextmanager
+    def job(self, name: str):
+        """
+            一个 Data_Spider 任务, 最外层的任务结束时输出这个任务期间各阶段的耗时, 嵌套的任务只记录 span
+            嵌套按 contextvars 判断, 不同线程里同时运行的任务各自统计, 各自输出
+        """
+        if not self.enabled or _job_stats.get() is not None:
+            with self.span(name):
+                yield
+            return
+        stats = {}
+        token = _job_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            with self.span(name):
+                yield
+        finally:
+            _job_stats.reset(token)
+            logger.info(f'任务 {name} 各阶段耗时:\n' + self.report(stats, time.perf_counter() - start, exclude=name))
+
+    def report(self, stats: dict = None, wall: float = None, exclude: str = None):
+        """
+            各阶段的次数, 总耗时, 平均耗时, 最长耗时; 多线程时各阶段的总耗时之和会超过实际经过的时间
+            :param stats: 某个任务的统计, 不传时为整个运行期间的
+            :param wall: 实际经过的秒数
+        """
+        with self.lock:
+            rows = []
+            for name, (count, total, longest) in (self.stats if stats is None else stats).items():
+                if count and name != exclude:
+                    rows.append((name, count, total, longest))
+        rows.sort(key=lambda row: row[2], reverse=True)
+        lines = [f'{"阶段":<24}{"次数":>8}{"总耗时(s)":>12}{"平均(ms)":>12}{"最长(ms)":>12}']
+        for name, count, total, longest in rows:
+            lines.append(f'{name:<24}{count:>8}{total:>12.3f}{total / count * 1000:>12.1f}{longest * 1000:>12.1f}')
+        if wall is not None:
+            lines.append(f'{"实际经过":<24}{"":>8}{wall:>12.3f}')
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.events = []
+
+    def dump_chrome_trace(self, file_path: str):
+        """
+            写成 chrome trace event 格式的 json, 每个线程一行
+        """
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+        trace_events = []
+        threads = {}
+        for name, start, duration, tid, thread_name, args in events:
+            threads[tid] = thread_name
+            trace_events.append({
+                'name': name,
+                'ph': 'X',
+                'ts': round((start - self.origin) * 1e6, 1),
+                'dur': round(duration * 1e6, 1),
+                'pid': pid,
+                'tid': tid,
+                'args': {key: str(value) for key, value in args.items()},
+            })
+        for tid, thread_name in threads.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+        with open(file_path, mode='w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+    def _dump_at_exit(self):
+        if self.trace_file and self.events:
+            self.dump_chrome_trace(self.trace_file)
+            logger.info(f'chrome trace 已写入 {self.trace_file}')
+
+
+@contextlib.contextmanager
+def profile(file_path: str = None):
+    """
+        用 cProfile 分析 with 块, 结果写入 file_path (用 snakeviz 或 pstats 查看), file_path 为空时不分析
+        cProfile 只分析当前线程, 线程池里的耗时可以看 tracer 的 span
+    """
+    if not file_path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(file_path)
+        logger.info(f'cProfile 结果已写入 {file_path}')
+
+
+def start_profile(file_path: str):
+    """
+        从现在开始用 cProfile 分析当前线程, 程序退出前写入 file_path, 设置环境变量 XHS_PROFILE 时自动开始
+    """
+    profiler = cProfile.Profile()
+
+    def dump():
+        profiler.disable()
+        profiler.dump_stats(file_path)
+        logger.info(f'cProfile 结果已写入 {file_path}')
+    atexit.register(dump)
+    profiler.enable()
+    return profiler
+
+
+tracer = Tracer(enabled=os.environ.get('XHS_TRACE', '') not in ('', '0') or bool(os.environ.get('XHS_TRACE_FILE')), trace_file=os.environ.get('XHS_TRACE_FILE') or None)
+if os.environ.get('XHS_PROFILE'):
+    start_profile(os.environ['XHS_PROFILE'])
@@ -1,11 +1,16 @@
 import json
+import os
 
-import execjs
+from xhs_utils.js_util import JS_Worker_Pool, static_path
 
-try:
-    js = execjs.compile(open(r'../static/xhs_creator_xs.js', 'r', encoding='utf-8').read())
-except:
-    js = execjs.compile(open(r'static/xhs_creator_xs.js', 'r', encoding='utf-8').read())
+js = JS_Worker_Pool(os.path.join(static_path, 'xhs_creator_xs.js'))
+
+
+def set_sign_workers(workers: int):
+    """
+        设置创作者中心签名进程的数量, 和 xhs_util.set_sign_workers 分别设置
+    """
+    js.resize(workers)
 
 
 def generate_xs(a1, api, data=''):
@@ -1,18 +1,73 @@
 import json
 import math
+import os
 import random
-import execjs
+import threading
+import time
+import urllib.parse
+from collections import deque
+from loguru import logger
 from xhs_utils.cookie_util import trans_cookies
+from xhs_utils.js_util import JS_Worker_Pool, static_path
+from xhs_utils.metrics_util import metrics
+from xhs_utils.trace_util import tracer
 
-try:
-    js = execjs.compile(open(r'../static/xhs_xs_xsc_56.js', 'r', encoding='utf-8').read())
-except:
-    js = execjs.compile(open(r'static/xhs_xs_xsc_56.js', 'r', encoding='utf-8').read())
+# 签名在常驻的 node 进程里完成, 进程数量可以通过环境变量 XHS_SIGN_WORKERS 或 set_sign_workers 指定
+js = JS_Worker_Pool(os.path.join(static_path, 'xhs_xs_xsc_56.js'))
+xray_js = JS_Worker_Pool(os.path.join(static_path, 'xhs_xray.js'), 1)
 
-try:
-    xray_js = execjs.compile(open(r'../static/xhs_xray.js', 'r', encoding='utf-8').read())
-except:
-    xray_js = execjs.compile(open(r'static/xhs_xray.js', 'r', encoding='utf-8').read())
+
+class Xray_Traceid_Pool():
+    """
+        x-xray-traceid 缓冲池, 在同一个常驻的 js 进程里批量生成
+        余量低于 low 时后台补充到 high, 取号只是一次 popleft
+        :param low: 低水位
+        :param high: 高水位
+        :param max_age: traceid 里带有生成时间, 超过这个秒数的直接丢弃
+    """
+    def __init__(self, low: int = 64, high: int = 512, max_age: float = 300):
+        self.low = low
+        self.high = high
+        self.max_age = max_age
+        self.ids = deque()
+        self.lock = threading.Lock()
+        self.refilling = False
+
+    def _generate(self, num):
+        now = time.time()
+        return [(now, trace_id) for trace_id in xray_js.call('traceIds', num)]
+
+    def _refill(self):
+        try:
+            while len(self.ids) < self.high:
+                self.ids.extend(self._generate(self.high - len(self.ids)))
+        except Exception as e:
+            logger.warning(f'x-xray-traceid 补充失败: {e}')
+        finally:
+            self.refilling = False
+
+    def _trigger_refill(self):
+        with self.lock:
+            if self.refilling:
+                return
+            self.refilling = True
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def get(self):
+        while True:
+            try:
+                created, trace_id = self.ids.popleft()
+            except IndexError:
+                # 冷启动或者消耗太快, 同步生成一批
+                self.ids.extend(self._generate(self.low))
+                continue
+            if len(self.ids) < self.low:
+                self._trigger_refill()
+            if time.time() - created <= self.max_age:
+                return trace_id
+
+
+xray_traceid_pool = Xray_Traceid_Pool()
 
 def generate_x_b3_traceid(len=16):
     x_b3_traceid = ""
@@ -20,6 +75,12 @@ def generate_x_b3_traceid(len=16):
         x_b3_traceid += "abcdef0123456789"[math.floor(16 * random.random())]
     return x_b3_traceid
 
+def set_sign_workers(workers: int):
+    """
+        设置签名进程的数量, 已启动的进程会被关闭, 下次签名时按新的数量启动
+    """
+    js.resize(workers)
+
 def generate_xs_xs_common(a1, api, data=''):
     ret = js.call('get_request_headers_params', api, data, a1)
     xs, xt, xs_common = ret['xs'], ret['xt'], ret['xs_common']
@@ -31,7 +92,7 @@ def generate_xs(a1, api, data=''):
     return xs, xt
 
 def generate_xray_traceid():
-    return xray_js.call('traceId')
+    return xray_traceid_pool.get()
 def get_common_headers():
     return {
         "authority": "www.xiaohongshu.com",
@@ -90,9 +151,23 @@ def generate_headers(a1, api, data=''):
 def generate_request_params(cookies_str, api, data=''):
     cookies = trans_cookies(cookies_str)
     a1 = cookies['a1']
-    headers, data = generate_headers(a1, api, data)
+    with metrics.timer('xhs_sign_seconds', gauge='xhs_sign_in_flight'), tracer.span('sign'):
+        headers, data = generate_headers(a1, api, data)
     return headers, cookies, data
 
+def parse_url(url):
+    """
+        解析笔记或用户主页的链接, 返回 路径最后一段的 id, query 参数
+        参数值按第一个 = 切分并保留原样, 不做 url 解码, 如 xsec_token=AB+cd= 得到 'AB+cd=', 所有接口用同一种形式
+    """
+    parsed = urllib.parse.urlparse(url)
+    query = {}
+    for kv in parsed.query.split('&'):
+        if kv:
+            key, _, value = kv.partition('=')
+            query[key] = value
+    return parsed.path.rstrip('/').split('/')[-1], query
+
 def splice_str(api, params):
     url = api + '?'
     for key, value in params.items():